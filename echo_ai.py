@@ -10,6 +10,8 @@ import RNS.vendor.umsgpack as msgpack
 import google.generativeai as ai
 import base64
 import struct
+from modular.scheduler import Scheduler
+from modular.utils import setup_logging, lazy
 
 # ------------------ CONFIGURATION ------------------ #
 # V1.2.0 - Updated to support telemetry history
@@ -20,6 +22,8 @@ ANNOUNCE_PATH = os.path.join(STORAGE_PATH, "echoannounce")
 TELEMETRY_DB_PATH = os.path.join(STORAGE_PATH, "telemetry.db")
 DISPLAY_NAME = "Echo/AI"
 ANNOUNCE_INTERVAL = 1800  # seconds
+ANNOUNCE_JITTER = 120  # seconds either way
+MODEL_NAME = "gemini-2.5-flash"
 
 # API Key from environment variable or fallback
 load_dotenv()
@@ -32,9 +36,8 @@ ai.configure(api_key=API_KEY)
 os.makedirs(STORAGE_PATH, exist_ok=True)
 
 # ------------------ LOGGING ------------------ #
-logging.basicConfig(level=RNS.LOG_VERBOSE, # Changed to LOG_VERBOSE for better debugging of SQLite operations
-                    format="%(asctime)s [%(levelname)s] %(message)s",
-                    handlers=[logging.StreamHandler()])
+# Records are formatted and written by a listener thread, off the delivery thread
+setup_logging(logging.INFO)
 logger = logging.getLogger("echo-ai")
 
 # The global DB_CONN is removed to fix threading issues.
@@ -210,7 +213,7 @@ def ai_chatbot_reply(message_content, historic_telemetry_list):
     
     historic_telemetry_list: List of the last N telemetry points, newest first.
     """
-    model = ai.GenerativeModel("gemini-2.5-flash")
+    model = ai.GenerativeModel(MODEL_NAME)
     chat = model.start_chat()
     
     preprompt = ""
@@ -310,9 +313,8 @@ def handle_incoming(message):
             # Decode the binary fields (like location)
             new_telemetry_data = decode_telemetry_data(unpacked_data)
             
-            # FIX: Use serialize_telemetry to log the hex-encoded data instead of the raw Python dict
-            logged_json_data = serialize_telemetry(new_telemetry_data)
-            RNS.log(f"Decoded fields data: {logged_json_data}", RNS.LOG_INFO)
+            # Serialized only when debug logging is enabled
+            logger.debug("Decoded fields data: %s", lazy(serialize_telemetry, new_telemetry_data))
 
             # 3. SAVE the newly decoded data to the database
             # This call now establishes its own thread-safe connection and INSERTS a new record
@@ -370,20 +372,6 @@ def send_message(destination_hash, message_content):
         logger.error(f"Send failed: {e}")
 
 
-def announce_check():
-    next_announce = int(time.time())
-    if os.path.isfile(ANNOUNCE_PATH):
-        try:
-            with open(ANNOUNCE_PATH, "r") as f:
-                next_announce = int(f.readline())
-        except Exception:
-            logger.warning("Failed to read announce file")
-
-    if time.time() >= next_announce:
-        with open(ANNOUNCE_PATH, "w") as f:
-            f.write(str(int(time.time()) + ANNOUNCE_INTERVAL))
-        announce_now(local_destination)
-
 # ------------------ MAIN ------------------ #
 # 1. Initialize DB before starting Reticulum
 init_db()
@@ -400,6 +388,8 @@ local_destination = message_router.register_delivery_identity(current_identity,
 message_router.register_delivery_callback(handle_incoming)
 logger.info(f"LXMF Router ready on: {RNS.prettyhexrep(local_destination.hash)}")
 
-while True:
-    announce_check()
-    time.sleep(10)
\ No newline at end of file
+# The scheduler sleeps until the next announce is due; its time is kept in ANNOUNCE_PATH
+scheduler = Scheduler(ANNOUNCE_PATH)
+scheduler.every("announce", ANNOUNCE_INTERVAL, lambda: announce_now(local_destination),
+                jitter=ANNOUNCE_JITTER, persist=True)
+scheduler.run()
\ No newline at end of file
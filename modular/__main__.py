@@ -1,38 +1,201 @@
+import time
+_started = time.perf_counter()
+
+import argparse, os
 from functools import partial
-from .lxmf_handler import handle_incoming
-from .utils import logger
-import RNS, LXMF, time, os
-from .config import CONFIG_DIR, IDENTITY_PATH, ANNOUNCE_INTERVAL
-from .db import init_db
+from .utils import logger, setup_logging, Startup
+from . import config
+from .config import (LOG_LEVEL, LOG_SAMPLE, CONFIG_DIR, IDENTITY_PATH, ANNOUNCE_INTERVAL, ANNOUNCE_JITTER, SCHEDULE_PATH,
+                     CHECKPOINT_INTERVAL, EXPIRY_INTERVAL, OUTBOX_EXPIRY_INTERVAL, WORKER_COUNT, QUEUE_MAX_DEPTH, QUEUE_MAX_CHAT,
+                     RETENTION_MAX_AGE, RETENTION_MAX_ROWS, RETENTION_BATCH, RETENTION_INTERVAL, ROLLUP_RETENTION,
+                     STORAGE_CODEC, STORAGE_COMPRESSION, STORAGE_COMPRESS_MIN_BYTES,
+                     DEDUP_MAX, DEDUP_TTL, DEDUP_PERSIST,
+                     METRICS_ENABLED, METRICS_FILE, METRICS_INTERVAL, METRICS_HTTP_PORT,
+                     OUTBOX_TTL, OUTBOX_MAX_ATTEMPTS, QUEUE_MAX_PER_SENDER,
+                     RATE_CHAT_PER_MIN, RATE_CHAT_BURST, RATE_INGEST_PER_MIN, RATE_INGEST_BURST,
+                     RATE_MAX_SENDERS, RATE_LIMIT_REPLY)
 
 def setup_identity():
+    import RNS
     if os.path.isfile(IDENTITY_PATH):
         return RNS.Identity.from_file(IDENTITY_PATH)
     identity = RNS.Identity()
     identity.to_file(IDENTITY_PATH)
     return identity
 
-def main():
+def _warm_backend():
+    from .ai_handler import get_backend
+    try:
+        get_backend()
+    except Exception as e:
+        logger.error("AI backend unavailable: %s", e)
+
+def run(startup):
+    # Imported here so maintenance commands skip the LXMF router and AI imports
+    import RNS, LXMF, threading
+    from . import metrics
+    # Instrumented before the handler's functions are imported below, so
+    # the names bound here are the timed wrappers
+    if METRICS_ENABLED:
+        metrics.enable()
+        metrics.instrument()
+    from .db import init_db, close as close_db, checkpoint, load_seen, store_seen, stats as db_stats
+    from .lxmf_handler import handle_incoming, send_message, replies
+    from .ai_handler import sessions, breaker
+    from .dedup import SeenMessages
+    from .dispatcher import Dispatcher
+    from .retention import Retention
+    from .outbox import Outbox
+    from .ratelimit import RateLimiter, Admission
+    from .scheduler import Scheduler
+    startup.done("imports")
+
     init_db()
+    seen = SeenMessages(DEDUP_MAX, DEDUP_TTL)
+    if DEDUP_PERSIST:
+        seen.load(load_seen(time.time() - DEDUP_TTL))
+    retention = Retention(RETENTION_MAX_AGE, RETENTION_MAX_ROWS, RETENTION_BATCH, ROLLUP_RETENTION)
+    startup.done("database")
     logger.info("Starting Reticulum...")
     reticulum = RNS.Reticulum(loglevel=RNS.LOG_INFO)
+    startup.done("reticulum")
     identity = setup_identity()
     router = LXMF.LXMRouter(identity=identity, storagepath=CONFIG_DIR)
     dest = router.register_delivery_identity(identity, display_name="Echo/AI")
+    startup.done("lxmf router")
+
+    # Held replies are retried when the recipient announces or answers a path request
+    outbox = Outbox(partial(send_message, local_destination=dest, message_router=router),
+                    OUTBOX_TTL, OUTBOX_MAX_ATTEMPTS)
+    outbox.start()
+    RNS.Transport.register_announce_handler(outbox)
 
-    # Bind the two extra arguments here
-    router.register_delivery_callback(
-        partial(handle_incoming, local_destination=dest, message_router=router)
+    notify = None
+    if RATE_LIMIT_REPLY:
+        notify = lambda source: send_message(source, RATE_LIMIT_REPLY, dest, router)
+    admission = Admission(
+        RateLimiter(RATE_CHAT_PER_MIN, RATE_CHAT_BURST, RATE_MAX_SENDERS),
+        RateLimiter(RATE_INGEST_PER_MIN, RATE_INGEST_BURST, RATE_MAX_SENDERS),
+        notify,
     )
 
-    logger.info(f"LXMF Router ready on: {RNS.prettyhexrep(dest.hash)}")
+    # The delivery callback only enqueues; workers run the handler
+    dispatcher = Dispatcher(
+        partial(handle_incoming, local_destination=dest, message_router=router, outbox=outbox),
+        workers=WORKER_COUNT, max_depth=QUEUE_MAX_DEPTH, max_chat=QUEUE_MAX_CHAT,
+        max_per_sender=QUEUE_MAX_PER_SENDER, seen=seen, admit=admission,
+    )
+    dispatcher.start()
+    router.register_delivery_callback(dispatcher.submit)
+
+    exporter = None
+    if METRICS_ENABLED:
+        metrics.gauge("dispatcher", dispatcher.stats)
+        metrics.gauge("db", db_stats)
+        metrics.gauge("sessions", sessions.stats)
+        metrics.gauge("reply_cache", replies.stats)
+        metrics.gauge("ai_breaker", lambda: {"state": breaker.state, "trips": breaker.trips})
+        metrics.gauge("dedup", lambda: {"size": len(seen), "duplicates": seen.duplicates})
+        metrics.gauge("outbox", outbox.stats)
+        metrics.gauge("rate_limits", admission.stats)
+        metrics.gauge("startup", startup.summary)
+        exporter = metrics.Exporter(METRICS_FILE, 0, METRICS_HTTP_PORT)
+        exporter.start()
+
+    def announce():
+        dest.announce()
+        logger.info("Node announced.")
+
+    def expire_caches():
+        sessions.expire()
+        replies.expire()
+
+    # Announces and maintenance all run from the main thread, off the message path
+    scheduler = Scheduler(SCHEDULE_PATH)
+    scheduler.every("announce", ANNOUNCE_INTERVAL, announce, jitter=ANNOUNCE_JITTER, persist=True)
+    scheduler.every("retention", RETENTION_INTERVAL, retention.sweep)
+    scheduler.every("checkpoint", CHECKPOINT_INTERVAL, checkpoint, delay=CHECKPOINT_INTERVAL)
+    scheduler.every("expire", EXPIRY_INTERVAL, expire_caches, delay=EXPIRY_INTERVAL)
+    scheduler.every("outbox", OUTBOX_EXPIRY_INTERVAL, outbox.expire)
+    if DEDUP_PERSIST:
+        # Stored periodically too, so a crash or kill -9 loses at most one interval
+        scheduler.every("seen", EXPIRY_INTERVAL, lambda: store_seen(seen.entries()), delay=EXPIRY_INTERVAL)
+    if exporter:
+        scheduler.every("stats", METRICS_INTERVAL, exporter.flush, delay=METRICS_INTERVAL)
+        metrics.gauge("scheduler", scheduler.stats)
+
+    logger.info("LXMF Router ready on: %s", RNS.prettyhexrep(dest.hash))
+    startup.done("services")
+    startup.report()
+    # Load the AI SDK in the background so the first question doesn't pay for it
+    threading.Thread(target=_warm_backend, name="echo-warmup", daemon=True).start()
+
+    # Installed after the router, whose own handlers would exit without cleanup
+    scheduler.stop_on_signals()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+    finally:
+        dispatcher.stop(timeout=30)
+        outbox.stop(timeout=5)
+        if exporter:
+            exporter.stop()
+        if DEDUP_PERSIST:
+            store_seen(seen.entries())
+        close_db()
+    return router
+
+def convert_storage(args):
+    from .db import init_db, close as close_db, convert
+    init_db(write_behind=False)
+    try:
+        count = convert(args.codec, args.compression or None, args.compress_min, args.batch)
+        logger.info("Converted %s telemetry rows to %s", count, args.codec)
+    finally:
+        close_db()
+
+def main(argv=None):
+    from . import bench, importer, export
+    parser = argparse.ArgumentParser(prog="python -m modular")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="run the Echo/AI node (default)")
+    p = commands.add_parser("convert", help="re-encode stored telemetry with another codec")
+    p.add_argument("--codec", default=STORAGE_CODEC, choices=["json", "msgpack"])
+    p.add_argument("--compression", default=STORAGE_COMPRESSION, choices=["", "zlib", "zstd"])
+    p.add_argument("--compress-min", type=int, default=STORAGE_COMPRESS_MIN_BYTES)
+    p.add_argument("--batch", type=int, default=1000)
+    p = commands.add_parser("bench", help="benchmark the message pipeline offline")
+    bench.add_arguments(p)
+    p = commands.add_parser("import", help="bulk import archived Sideband telemetry")
+    importer.add_arguments(p)
+    p = commands.add_parser("export", help="stream stored telemetry to NDJSON or CSV")
+    export.add_arguments(p)
+    p = commands.add_parser("stats", help="per sender row counts, time ranges and sizes")
+    export.add_stats_arguments(p)
+    args = parser.parse_args(argv)
 
-    next_announce = 0
-    while True:
-        if time.time() >= next_announce:
-            dest.announce()
-            next_announce = time.time() + ANNOUNCE_INTERVAL
-        time.sleep(10)
+    listener = setup_logging(LOG_LEVEL, LOG_SAMPLE)
+    config.load()
+    startup = Startup(_started)
+    if args.command == "convert":
+        convert_storage(args)
+    elif args.command == "bench":
+        bench.main(args)
+    elif args.command == "import":
+        importer.main(args)
+    elif args.command == "export":
+        export.main(args)
+    elif args.command == "stats":
+        export.report(args)
+    else:
+        router = run(startup)
+        # LXMF and RNS tear down last; RNS.exit ends the process with os._exit,
+        # which skips atexit hooks, so the log queue is drained first
+        import RNS
+        router.exit_handler()
+        listener.stop()
+        RNS.exit(0)
 
 if __name__ == "__main__":
     main()
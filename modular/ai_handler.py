@@ -1,49 +1,325 @@
-import time, google.generativeai as ai
-from .config import API_KEY
-from .db import serialize
-from .utils import logger
-
-ai.configure(api_key=API_KEY)
-
-def build_prompt(history):
-    if not history:
-        return "You are Echo/AI Assistant. No telemetry available."
-    
-    lines = []
-    for i, entry in enumerate(history):
-        ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['updated_at']))
-        prefix = "NEWEST" if i == 0 else f"PREVIOUS {i}"
-        lines.append(f"--- {prefix} ({ts}) ---\n{serialize(entry['data'])}\n")
-        preprompt =f"""
-        Keys are as follows:
-        1 time.utc (UNIX timestamp, int32)
-        2 location data (DECODED GPS coordinates: [latitude, longitude, altitude, ...])
-        3 unused / null
-        4 battery → [charge_percent (float), charging (bool), temperature (nullable float)]
-        6 acceleration → [x, y, z] (float)
-        7 unused
-        8 unused
-        9 magnetic_field → [x, y, z] (float)
-        10 ambient_light.lux (float)
-        11 gravity → [x, y, z] (float)
-        12 angular_velocity → [x, y, z] (float)
-        14 proximity (bool)
-        15 information.contents (string)
-        25 rns_transport (network transport stats & interfaces, keep as structured JSON object 
-        (Reticulum distinguishes between two types of network nodes. 
-        All nodes on a Reticulum network are Reticulum Instances, and some are also Transport Nodes)
-        """
-    return (
-        "You are the Echo/AI Assistant on the Reticulum mesh.\n"
-        "Analyze trends in the sensor telemetry below.\n\n" + "\n".join(lines).join(preprompt)
-    )
-
-def get_reply(message, history):
+import random, re, threading, time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from .config import (settings, MODEL_NAME, SESSION_MAX, SESSION_TTL, SESSION_MAX_TURNS,
+                     AI_DEADLINE, AI_RETRIES, AI_BACKOFF, BREAKER_THRESHOLD, BREAKER_RESET, STREAM_MIN_CHUNK)
+from .prompt import build_prompt, build_update, SYSTEM_PROMPT
+from .utils import logger, kv
+from . import metrics
+
+UNAVAILABLE_REPLY = "AI service unavailable."
+BREAKER_REPLY = "The AI service is having trouble right now. Please try again in a few minutes."
+
+
+class Backend(ABC):
+    """Interface for AI backends: chats are opaque objects owned by the backend."""
+
+    name = "base"
+
+    @abstractmethod
+    def start_chat(self):
+        ...
+
+    @abstractmethod
+    def send(self, chat, prompt, timeout):
+        ...
+
+    def stream(self, chat, prompt, timeout):
+        """Yields the reply in fragments; backends without streaming yield it whole."""
+        yield self.send(chat, prompt, timeout)
+
+    def retryable(self, error):
+        return True
+
+
+class GeminiBackend(Backend):
+    name = "gemini"
+    # Errors that a retry cannot fix
+    FATAL = {"InvalidArgument", "PermissionDenied", "Unauthenticated", "NotFound"}
+
+    def __init__(self, api_key=None, model_name=MODEL_NAME):
+        api_key = api_key or settings.api_key
+        if not api_key:
+            raise RuntimeError("Missing GEMINI_API_KEY environment variable.")
+        # Imported on first use; the SDK is by far the slowest import here
+        import google.generativeai as ai
+        ai.configure(api_key=api_key)
+        self.model = ai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
+
+    def start_chat(self):
+        return self.model.start_chat()
+
+    def send(self, chat, prompt, timeout):
+        # The chat history is only extended on success, so a failed send can be retried
+        return chat.send_message(prompt, request_options={"timeout": timeout}).text
+
+    def stream(self, chat, prompt, timeout):
+        # The first fragment is fetched by send_message itself, so errors before
+        # any output surface here and leave the chat history untouched
+        for chunk in chat.send_message(prompt, stream=True, request_options={"timeout": timeout}):
+            yield chunk.text
+
+    def retryable(self, error):
+        return type(error).__name__ not in self.FATAL
+
+
+class StubBackend(Backend):
+    """Offline backend with deterministic replies and optional latency, for tests and benchmarks."""
+
+    name = "stub"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def start_chat(self):
+        return []
+
+    def send(self, chat, prompt, timeout):
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+        chat.append(prompt)
+        message = prompt.rpartition("User message:\n")[2]
+        return f"Echo/AI (stub) turn {len(chat)}: received {len(message)} chars, context {len(prompt)} chars."
+
+    def stream(self, chat, prompt, timeout):
+        # Same reply as send, split into word fragments with the latency spread over them
+        words = self.send(chat, prompt, 0).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+
+
+BACKENDS = {"gemini": GeminiBackend, "stub": StubBackend}
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call
+    through every `reset` seconds until a call succeeds again."""
+
+    def __init__(self, threshold, reset):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset:
+                # Half-open: admit one trial and hold the others back until it reports
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    self.trips += 1
+                    logger.warning("AI circuit breaker open after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+
+_backend = None
+_backend_lock = threading.Lock()
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[settings.ai_backend]()
+            logger.info("Using AI backend: %s", _backend.name)
+        return _backend
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    sessions.clear()
+
+
+class Session:
+    __slots__ = ("chat", "seen", "last_used")
+
+    def __init__(self, chat):
+        self.chat = chat
+        self.seen = 0  # updated_at of the newest reading already sent
+        self.last_used = time.monotonic()
+
+
+class SessionCache:
+    """Chat sessions per sender, bounded by count (LRU) and idle time."""
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source):
+        with self._lock:
+            session = self._sessions.get(source)
+            if session is None:
+                return None
+            if time.monotonic() - session.last_used > self.ttl:
+                del self._sessions[source]
+                self.expirations += 1
+                return None
+            self._sessions.move_to_end(source)
+            return session
+
+    def put(self, source, session):
+        with self._lock:
+            self._sessions[source] = session
+            self._sessions.move_to_end(source)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def drop(self, source):
+        with self._lock:
+            self._sessions.pop(source, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            for source in [s for s, session in self._sessions.items() if now - session.last_used > self.ttl]:
+                del self._sessions[source]
+                self.expirations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._sessions), "evictions": self.evictions, "expirations": self.expirations}
+
+
+sessions = SessionCache(SESSION_MAX, SESSION_TTL)
+
+def _trim(chat):
+    # Keep the opening turn, which carries the telemetry baseline, plus the
+    # most recent turns; each turn is a user and a model entry.
+    history = getattr(chat, "history", None)
+    if history is not None and len(history) > 2 * (SESSION_MAX_TURNS + 1):
+        chat.history = history[:2] + history[-2 * SESSION_MAX_TURNS:]
+
+def _backoff(backend, error, attempt, retries, end):
+    # Re-raises error when no retry is left, otherwise sleeps before attempt + 1
+    delay = random.uniform(0, AI_BACKOFF * 2 ** attempt)
+    if attempt >= retries or not backend.retryable(error) or time.monotonic() + delay >= end:
+        raise error
+    metrics.count("ai.retries")
+    logger.warning("AI request failed (%s), retry %s/%s in %.2fs", error, attempt + 1, retries, delay)
+    time.sleep(delay)
+
+def send_with_retry(backend, chat, prompt, deadline=AI_DEADLINE, retries=AI_RETRIES):
+    """Sends prompt within `deadline` seconds, retrying with jittered exponential backoff."""
+    end = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        try:
+            return backend.send(chat, prompt, timeout=max(end - time.monotonic(), 0.1))
+        except Exception as e:
+            _backoff(backend, e, attempt, retries, end)
+            attempt += 1
+
+# A sentence end followed by whitespace, or a line break
+_BOUNDARY = re.compile(r"(?<=[.!?])\s|\n")
+
+def first_chunk(text, min_chars=STREAM_MIN_CHUNK):
+    """The longest-awaited prefix worth sending early: text up to the first
+    sentence or paragraph boundary at or after min_chars, or None."""
+    match = _BOUNDARY.search(text, min_chars)
+    return text[:match.start()] if match else None
+
+def stream_with_retry(backend, chat, prompt, on_first, deadline=AI_DEADLINE, retries=AI_RETRIES):
+    """Like send_with_retry, but hands the first chunk to on_first as soon as it
+    is complete. Only failures before that are retried, since a retry after it
+    would repeat text the recipient already has."""
+    start = time.monotonic()
+    end = start + deadline
+    attempt = 0
+    while True:
+        fragments, sent = [], False
+        try:
+            for fragment in backend.stream(chat, prompt, timeout=max(end - time.monotonic(), 0.1)):
+                fragments.append(fragment)
+                if time.monotonic() > end:
+                    raise TimeoutError("AI stream exceeded its deadline")
+                if not sent:
+                    chunk = first_chunk("".join(fragments))
+                    if chunk:
+                        sent = True
+                        metrics.observe("ai.first_chunk", time.monotonic() - start)
+                        on_first(chunk)
+            return "".join(fragments)
+        except Exception as e:
+            if sent:
+                raise
+            _backoff(backend, e, attempt, retries, end)
+            attempt += 1
+
+def _resolve(value):
+    return value() if callable(value) else value
+
+def get_reply(message, history, source=None, trends=None, on_first=None, nearby=None):
+    """Returns the full reply. With on_first the model output is streamed and
+    on_first receives an early prefix of the reply, if one completes in time.
+
+    trends and nearby are only used to open a session, so either may be a
+    callable that loads them; it is then called only when one is opened.
+    """
+    if not breaker.allow():
+        metrics.count("ai.breaker_rejected")
+        return BREAKER_REPLY
+    started = time.monotonic()
+    session = sessions.get(source) if source else None
     try:
-        model = ai.GenerativeModel("gemini-2.5-flash")
-        chat = model.start_chat()
-        response = chat.send_message(build_prompt(history) + message)
-        return response.text
+        backend = get_backend()
+        if session is None:
+            session = Session(backend.start_chat())
+            context = build_prompt(history, preamble=False, trends=_resolve(trends), nearby=_resolve(nearby))
+        else:
+            context = build_update(history, session.seen)
+        prompt = f"{context}\nUser message:\n{message}" if context else message
+        if on_first is not None:
+            reply = stream_with_retry(backend, session.chat, prompt, on_first)
+        else:
+            reply = send_with_retry(backend, session.chat, prompt)
     except Exception as e:
-        logger.error(f"AI request failed: {e}")
-        return "AI service unavailable."
+        breaker.failure()
+        metrics.error("ai", e)
+        logger.error("AI request failed: %s", e, extra=kv("ai", sender=source and source[:5]))
+        if source:
+            sessions.drop(source)
+        return UNAVAILABLE_REPLY
+
+    breaker.success()
+    logger.info("AI reply", extra=kv("ai", sender=source and source[:5], stage="get_reply",
+                                     duration=f"{time.monotonic() - started:.3f}", chars=len(reply)))
+    if history:
+        session.seen = history[0]["updated_at"]
+    session.last_used = time.monotonic()
+    _trim(session.chat)
+    if source:
+        sessions.put(source, session)
+    return reply
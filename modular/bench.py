@@ -0,0 +1,181 @@
+import os, random, struct, tempfile, threading, time
+from functools import wraps
+from .utils import logger
+
+STAGES = ("unpack_telemetry", "decode", "save", "load_history", "get_reply", "send_message", "total")
+
+
+class SyntheticMessage:
+    __slots__ = ("hash", "source_hash", "content", "fields")
+
+    def __init__(self, source_hash, content, fields):
+        self.hash = os.urandom(32)
+        self.source_hash = source_hash
+        self.content = content
+        self.fields = fields
+
+
+class FakeRouter:
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def handle_outbound(self, lxm):
+        with self._lock:
+            self.sent.append((lxm.destination_hash, len(lxm.content)))
+
+    def get_outbound_propagation_node(self):
+        return None
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+# Reticulum and the handler are imported on use, so parsing arguments stays cheap
+
+def make_sender(identities):
+    import RNS
+    identity = RNS.Identity()
+    dest_hash = RNS.Destination.hash(identity, "lxmf", "delivery")
+    identities[dest_hash] = identity
+    return dest_hash
+
+def make_transport(interfaces):
+    return {
+        "transport_enabled": True,
+        "transport_uptime": random.randint(0, 10 ** 6),
+        "traffic_rxb": random.randint(0, 10 ** 9),
+        "traffic_txb": random.randint(0, 10 ** 9),
+        "speed_rx": random.random() * 1e4,
+        "speed_tx": random.random() * 1e4,
+        "ifstats": {"interfaces": [{
+            "name": f"RNodeInterface[LoRa {i}]",
+            "type": "RNodeInterface",
+            "status": True,
+            "bitrate": 1200 * (i + 1),
+            "rxb": random.randint(0, 10 ** 8),
+            "txb": random.randint(0, 10 ** 8),
+            "rssi": -random.randint(40, 120),
+            "snr": random.random() * 20 - 5,
+            "hash": os.urandom(16),
+        } for i in range(interfaces)]},
+    }
+
+def make_telemetry(interfaces):
+    import RNS.vendor.umsgpack as msgpack
+    now = int(time.time())
+    lat, lon = random.uniform(-90, 90), random.uniform(-180, 180)
+    data = {
+        1: now,
+        2: [struct.pack("!i", int(lat * 1e6)), struct.pack("!i", int(lon * 1e6)),
+            struct.pack("!i", random.randint(0, 100000)), struct.pack("!I", 0),
+            struct.pack("!i", 0), struct.pack("!H", 500), now],
+        4: [random.uniform(0, 100), random.random() < 0.5, random.uniform(10, 40)],
+        10: random.uniform(0, 2000),
+    }
+    if interfaces:
+        data[25] = make_transport(interfaces)
+    return msgpack.packb(data)
+
+def run_bench(messages, senders, text_ratio, telemetry_ratio, interfaces, latency, workers):
+    import RNS, LXMF
+    from . import db, ai_handler, lxmf_handler
+    from .dispatcher import Dispatcher
+    workdir = tempfile.mkdtemp(prefix="echo-bench-")
+    path = os.path.join(workdir, "telemetry.db")
+    db.init_db(path)
+    ai_handler.set_backend(ai_handler.StubBackend(latency))
+
+    timings = Timings()
+    # Wrap the handler's collaborators in place so every stage is timed
+    originals = {stage: getattr(lxmf_handler, stage)
+                 for stage in STAGES[:-1]}
+    for stage, fn in originals.items():
+        setattr(lxmf_handler, stage, timings.wrap(stage, fn))
+
+    router = FakeRouter()
+    local = RNS.Destination(RNS.Identity(), RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
+    handler = timings.wrap("total", lambda message, reply=True, ingest=True: lxmf_handler.handle_incoming(
+        message, local_destination=local, message_router=router, reply=reply, ingest=ingest))
+
+    identities = {}
+    pool = [make_sender(identities) for _ in range(senders)]
+    # There is no running Reticulum instance, so senders are "known" from this table
+    real_recall = RNS.Identity.recall
+    RNS.Identity.recall = staticmethod(lambda target_hash, *args, **kwargs: identities.get(target_hash))
+    inbox = []
+    for i in range(messages):
+        fields = {}
+        if random.random() < telemetry_ratio:
+            fields[LXMF.FIELD_TELEMETRY] = make_telemetry(interfaces)
+        content = f"How is my node doing? ({i})".encode() if random.random() < text_ratio else b""
+        inbox.append(SyntheticMessage(random.choice(pool), content, fields))
+
+    start = time.perf_counter()
+    if workers:
+        dispatcher = Dispatcher(handler, workers=workers, max_depth=messages, max_chat=messages)
+        dispatcher.start()
+        for message in inbox:
+            dispatcher.submit(message)
+        dispatcher.stop()
+    else:
+        for message in inbox:
+            handler(message)
+    elapsed = time.perf_counter() - start
+
+    db.close()
+    size = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir))
+    for stage, fn in originals.items():
+        setattr(lxmf_handler, stage, fn)
+    RNS.Identity.recall = real_recall
+    return {"elapsed": elapsed, "messages": messages, "replies": len(router.sent),
+            "db_bytes": size, "path": path, "timings": timings.samples}
+
+def report(result):
+    print(f"Messages:   {result['messages']} in {result['elapsed']:.2f}s "
+          f"({result['messages'] / result['elapsed']:.1f} msg/s), {result['replies']} replies")
+    print(f"DB size:    {result['db_bytes'] / 1024:.1f} KiB "
+          f"({result['db_bytes'] / max(result['messages'], 1):.0f} bytes/message) at {result['path']}")
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage in STAGES:
+        values = result["timings"][stage]
+        print(f"{stage:<18}{len(values):>8}" + "".join(
+            f"{percentile(values, p) * 1000:>10.3f}" for p in (50, 95, 99)))
+
+def main(args):
+    logger.setLevel("WARNING")
+    result = run_bench(args.messages, args.senders, args.text_ratio, args.telemetry_ratio,
+                       args.interfaces, args.latency, args.workers)
+    report(result)
+
+def add_arguments(parser):
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--text-ratio", type=float, default=0.3, help="share of messages asking a question")
+    parser.add_argument("--telemetry-ratio", type=float, default=0.9, help="share of messages carrying telemetry")
+    parser.add_argument("--interfaces", type=int, default=4, help="interfaces per rns_transport payload (0 omits it)")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub AI latency in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="dispatcher workers (0 calls the handler directly)")
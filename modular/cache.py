@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict, deque
+
+
+class _Ring:
+    __slots__ = ("entries", "complete", "size")
+
+    def __init__(self, maxlen):
+        self.entries = deque(maxlen=maxlen)  # (updated_at, data, nbytes), newest first
+        self.complete = False  # True when the ring holds every stored row for the sender
+        self.size = 0
+
+
+class HistoryCache:
+    """Last N decoded telemetry entries per sender, LRU across senders.
+
+    Memory is bounded by both the number of senders and the approximate
+    encoded size of the cached entries.
+    """
+
+    def __init__(self, per_sender, max_senders, max_bytes):
+        self.per_sender = per_sender
+        self.max_senders = max_senders
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._rings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source, limit):
+        with self._lock:
+            ring = self._rings.get(source)
+            if ring is None or limit > self.per_sender or (len(ring.entries) < limit and not ring.complete):
+                self.misses += 1
+                return None
+            self._rings.move_to_end(source)
+            self.hits += 1
+            return [{"updated_at": ts, "data": data} for ts, data, _ in list(ring.entries)[:limit]]
+
+    def add(self, source, updated_at, data, nbytes):
+        with self._lock:
+            ring = self._rings.get(source)
+            if ring is None:
+                ring = self._rings[source] = _Ring(self.per_sender)
+            else:
+                self._rings.move_to_end(source)
+            if len(ring.entries) == ring.entries.maxlen:
+                ring.size -= ring.entries[-1][2]
+                self.bytes -= ring.entries[-1][2]
+                ring.complete = False
+            ring.entries.appendleft((updated_at, data, nbytes))
+            ring.size += nbytes
+            self.bytes += nbytes
+            self._evict()
+
+    def fill(self, source, history, sizes, limit):
+        # history is newest first, as returned by a DB load of `limit` rows
+        with self._lock:
+            old = self._rings.pop(source, None)
+            if old is not None:
+                self.bytes -= old.size
+            ring = self._rings[source] = _Ring(self.per_sender)
+            for entry, nbytes in zip(history[:self.per_sender], sizes):
+                ring.entries.append((entry["updated_at"], entry["data"], nbytes))
+                ring.size += nbytes
+            ring.complete = len(history) < limit
+            self.bytes += ring.size
+            self._evict()
+
+    def _evict(self):
+        while len(self._rings) > self.max_senders or (self.bytes > self.max_bytes and len(self._rings) > 1):
+            _, ring = self._rings.popitem(last=False)
+            self.bytes -= ring.size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "senders": len(self._rings),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,78 @@
+import importlib.util, json, os, sys, zlib
+from .utils import safe_json
+
+def _load_msgpack():
+    """RNS's vendored umsgpack, loaded from its file so that maintenance
+    commands don't pay for importing the whole RNS package."""
+    if "RNS.vendor.umsgpack" in sys.modules:
+        return sys.modules["RNS.vendor.umsgpack"]
+    spec = importlib.util.find_spec("RNS")
+    path = os.path.join(spec.submodule_search_locations[0], "vendor", "umsgpack.py")
+    if not os.path.isfile(path):
+        import RNS.vendor.umsgpack as msgpack
+        return msgpack
+    spec = importlib.util.spec_from_file_location("modular._umsgpack", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+msgpack = _load_msgpack()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Storage codecs for telemetry payloads. The codec name is stored per row,
+# so rows written with different settings can live side by side.
+
+def _json_encode(data):
+    return json.dumps(data, default=safe_json).encode("utf-8")
+
+def _msgpack_decode(payload):
+    return msgpack.unpackb(payload)
+
+def _zstd_compress(payload):
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the 'zstandard' package")
+    return zstandard.ZstdCompressor().compress(payload)
+
+def _zstd_decompress(payload):
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the 'zstandard' package")
+    return zstandard.ZstdDecompressor().decompress(payload)
+
+CODECS = {
+    "json": (_json_encode, json.loads),
+    "msgpack": (msgpack.packb, _msgpack_decode),
+}
+
+COMPRESSORS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "zstd": (_zstd_compress, _zstd_decompress),
+}
+
+# Codecs that return exactly what was stored (int keys and bytes survive)
+LOSSLESS = {"msgpack"}
+
+def encode(data, codec, compression=None, compress_min=0):
+    """Returns (codec_name, payload), where codec_name includes any compression used."""
+    payload = CODECS[codec][0](data)
+    if compression and len(payload) >= compress_min:
+        return f"{codec}+{compression}", COMPRESSORS[compression][0](payload)
+    return codec, payload
+
+def decode(payload, codec):
+    codec, _, compression = codec.partition("+")
+    if compression:
+        payload = COMPRESSORS[compression][1](payload)
+    return CODECS[codec][1](payload)
+
+def restore_keys(data):
+    # JSON turns the integer sensor keys into strings; undo that for old rows
+    if isinstance(data, dict):
+        return {int(k) if isinstance(k, str) and k.isdigit() else k: v for k, v in data.items()}
+    return data
+
+def is_lossless(codec):
+    return codec.partition("+")[0] in LOSSLESS
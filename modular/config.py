@@ -1,18 +1,155 @@
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 
 CONFIG_DIR = os.path.expanduser("~/.nomadmb")
 STORAGE_PATH = os.path.join(CONFIG_DIR, "storage")
 IDENTITY_PATH = os.path.join(STORAGE_PATH, "echoidentity")
 ANNOUNCE_PATH = os.path.join(STORAGE_PATH, "echoannounce")
-TELEMETRY_DB_PATH = os.path.join(STORAGE_PATH, "telemetry.db")
+# The modular node keeps its own database; echo_ai.py still uses telemetry.db,
+# whose schema it expects unchanged. Its readings are copied over on first start.
+TELEMETRY_DB_PATH = os.path.join(STORAGE_PATH, "modular.db")
+LEGACY_DB_PATH = os.path.join(STORAGE_PATH, "telemetry.db")
 DISPLAY_NAME = "Echo/AI"
+
+# Logging goes through a queue to a writer thread; LOG_SAMPLE keeps one in N
+# info/debug records per category ("message", "telemetry", "prompt", "ai", "send")
+LOG_LEVEL = "INFO"
+LOG_SAMPLE = {"telemetry": 10}
 ANNOUNCE_INTERVAL = 1800  # seconds
+ANNOUNCE_JITTER = 120  # seconds either way, so nodes started together drift apart
+SCHEDULE_PATH = os.path.join(STORAGE_PATH, "schedule.json")  # next run times of periodic jobs
+
+# Periodic maintenance, run by the scheduler (seconds)
+CHECKPOINT_INTERVAL = 300  # passive WAL checkpoint
+EXPIRY_INTERVAL = 300  # idle chat sessions and stale cached replies
+OUTBOX_EXPIRY_INTERVAL = 600
+
+# Inbound dispatcher
+WORKER_COUNT = 4
+QUEUE_MAX_DEPTH = 256  # pending messages before new ones are dropped
+QUEUE_MAX_CHAT = 32  # pending chat requests before the oldest is shed to ingest-only
+QUEUE_MAX_PER_SENDER = 16  # pending messages one sender may hold
+
+# Per-sender token buckets; over-budget questions are dropped, optionally
+# with one short notice (RATE_LIMIT_REPLY = None drops them silently)
+RATE_CHAT_PER_MIN = 6
+RATE_CHAT_BURST = 3
+RATE_INGEST_PER_MIN = 60
+RATE_INGEST_BURST = 20
+RATE_MAX_SENDERS = 4096  # buckets kept in memory, least recently seen dropped first
+RATE_LIMIT_REPLY = "You're sending questions faster than Echo/AI can answer. Please wait a minute and try again."
+
+# Duplicate suppression and repeated-question reply cache
+DEDUP_MAX = 10000  # message hashes remembered
+DEDUP_TTL = 24 * 3600  # seconds
+DEDUP_PERSIST = True  # keep seen hashes across restarts
+REPLY_CACHE_MAX = 1024
+REPLY_CACHE_TTL = 300  # seconds
+
+# Hot-path metrics, written to a stats file and optionally served on localhost
+METRICS_ENABLED = False
+METRICS_FILE = os.path.join(STORAGE_PATH, "stats.json")
+METRICS_INTERVAL = 60  # seconds between stats file writes
+METRICS_HTTP_PORT = 0  # 0 disables the read-only HTTP endpoint
+
+# Outbox for replies to senders whose path is not known yet
+OUTBOX_TTL = 24 * 3600  # seconds a reply waits before it is dropped
+OUTBOX_MAX_ATTEMPTS = 5
+
+# SQLite
+DB_CACHE_KB = 8192  # page cache per connection
+DB_STATEMENT_CACHE = 256  # prepared statements kept per connection (sqlite3's default is 128)
+
+# Write-behind telemetry inserts (group commit)
+WRITE_BEHIND = True
+WRITE_BATCH_SIZE = 64  # rows per transaction
+WRITE_MAX_STALENESS_MS = 500  # longest a reading waits before it is committed
+WRITE_FLUSH_ON_SHUTDOWN = True
+WRITE_MAX_RETRIES = 5  # attempts at a batch the database keeps rejecting before it is dropped
+WRITE_MAX_PENDING = 10000  # buffered rows; the oldest are dropped beyond this
+
+# Telemetry storage codec: "json" or "msgpack", optionally compressed with
+# "zlib" or "zstd" (needs the zstandard package) when a row is large enough
+STORAGE_CODEC = "msgpack"
+STORAGE_COMPRESSION = "zlib"
+STORAGE_COMPRESS_MIN_BYTES = 256
+
+# AI model and per-sender chat sessions; the backend is chosen in Settings
+MODEL_NAME = "gemini-2.5-flash"
+AI_DEADLINE = 30  # seconds per reply, retries included
+AI_RETRIES = 2
+AI_BACKOFF = 0.5  # base seconds, doubled per retry with full jitter
+BREAKER_THRESHOLD = 5  # consecutive failures before failing fast
+BREAKER_RESET = 30  # seconds before a trial request is let through
+# Streaming: the first sentence or paragraph past STREAM_MIN_CHUNK characters
+# is sent while the model is still generating, the rest when it is done
+AI_STREAMING = False
+STREAM_MIN_CHUNK = 120
+SESSION_MAX = 256  # cached chat sessions, least recently used evicted first
+SESSION_TTL = 3600  # seconds idle before a session is dropped
+SESSION_MAX_TURNS = 10  # recent turns kept per session besides the opening one
+
+# Prompt size budget; older readings are dropped first when it is exceeded
+PROMPT_BUDGET_CHARS = 6000
+
+# Per-sender telemetry history cache in front of load_history
+CACHE_PER_SENDER = 16  # entries kept per sender
+CACHE_MAX_SENDERS = 1024
+CACHE_MAX_BYTES = 32 * 1024 * 1024  # approximate, measured on the encoded rows
+
+# Telemetry retention, enforced incrementally in the background (0 disables)
+RETENTION_MAX_AGE = 90 * 24 * 3600  # seconds
+RETENTION_MAX_ROWS = 10000  # per sender
+RETENTION_BATCH = 500  # rows deleted per transaction
+RETENTION_INTERVAL = 60  # seconds between sweeps
+
+# Hourly and daily telemetry rollups, kept per resolution for this many seconds
+ROLLUP_RETENTION = {3600: 14 * 24 * 3600, 86400: 400 * 24 * 3600}
+
+# Reply shaping. Replies are compacted to a per-destination character budget,
+# smaller when the next hop is slower than SLOW_LINK_BITRATE (bits/s), and on
+# slow links may go out as up to REPLY_MAX_PARTS single-packet parts.
+REPLY_TITLE = "Reply"
+REPLY_MAX_CHARS = 1500
+REPLY_SLOW_MAX_CHARS = 500
+REPLY_BUDGETS = {}  # destination hash hex -> character budget
+SLOW_LINK_BITRATE = 10000
+REPLY_CHUNKING = True
+REPLY_MAX_PARTS = 3
+
+# rns_transport (sensor 25) blobs are replaced by a compact summary in stored
+# readings. The raw blob is kept once per reading in net_summary, compressed
+# ("compress"), not at all ("drop"), or left in the reading as before ("keep").
+NETSTATS_RAW = "compress"
+NETSTATS_MAX_SENDERS = 1024  # senders whose last traffic counters are kept in memory
+
+# Long-term trend windows summarized in the prompt, and their size budget
+TREND_WINDOWS = (("24h", 24 * 3600), ("7d", 7 * 24 * 3600), ("30d", 30 * 24 * 3600))
+TREND_BUDGET_CHARS = 800
+
+# Other senders near the sender's latest position, listed in the prompt
+NEARBY_COUNT = 5
+NEARBY_MAX_AGE = 24 * 3600  # only senders whose latest position is this recent
+NEARBY_BUDGET_CHARS = 400
+
+
+class Settings:
+    """Settings read from the environment. Importing this module has no side
+    effects; load() also reads .env and prepares the storage directory."""
+
+    def __init__(self):
+        self.read()
+
+    def read(self):
+        # Only the Gemini backend needs a key; it checks for one when it is created
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        self.ai_backend = os.getenv("ECHO_AI_BACKEND", "gemini")  # "gemini" or the offline "stub"
+
 
-os.makedirs(STORAGE_PATH, exist_ok=True)
+settings = Settings()
 
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise RuntimeError("Missing GEMINI_API_KEY environment variable.")
\ No newline at end of file
+def load(env_file=None):
+    from dotenv import load_dotenv
+    load_dotenv(env_file)
+    settings.read()
+    os.makedirs(STORAGE_PATH, exist_ok=True)
+    return settings
\ No newline at end of file
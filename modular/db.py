@@ -1,43 +1,647 @@
-import sqlite3, time, json
-from .config import TELEMETRY_DB_PATH
-from .utils import logger, safe_json
+import os, sqlite3, threading, time, json
+from .config import (TELEMETRY_DB_PATH, LEGACY_DB_PATH, DB_CACHE_KB, DB_STATEMENT_CACHE,
+                     WRITE_BEHIND, WRITE_BATCH_SIZE, WRITE_MAX_STALENESS_MS, WRITE_FLUSH_ON_SHUTDOWN,
+                     WRITE_MAX_RETRIES, WRITE_MAX_PENDING,
+                     CACHE_PER_SENDER, CACHE_MAX_SENDERS, CACHE_MAX_BYTES,
+                     STORAGE_CODEC, STORAGE_COMPRESSION, STORAGE_COMPRESS_MIN_BYTES, TREND_WINDOWS,
+                     NETSTATS_RAW, NETSTATS_MAX_SENDERS)
+from .utils import logger, safe_json, kv
+from . import codec, rollup, netstats, geo
+from .telemetry import to_plain
+from .writebehind import WriteBehind
+from .cache import HistoryCache
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    ("""
+        CREATE TABLE IF NOT EXISTS telemetry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_hash_hex TEXT NOT NULL,
+            telemetry_json TEXT NOT NULL,
+            updated_at REAL
+        )
+    """,),
+    (
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_source_time ON telemetry (source_hash_hex, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_time ON telemetry (updated_at)",
+    ),
+    # Per-row storage codec. Renaming keeps this O(1) on large tables; binary
+    # payloads keep their BLOB storage class despite the column's TEXT affinity.
+    (
+        "ALTER TABLE telemetry RENAME COLUMN telemetry_json TO payload",
+        "ALTER TABLE telemetry ADD COLUMN codec TEXT NOT NULL DEFAULT 'json'",
+    ),
+    # Message hashes already handled, kept across restarts for deduplication
+    (
+        "CREATE TABLE IF NOT EXISTS seen_messages (hash BLOB PRIMARY KEY, seen_at REAL NOT NULL)",
+    ),
+    # Replies waiting for a path to their recipient
+    (
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            destination_hex TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_destination ON outbox (destination_hex, expires_at)",
+    ),
+    # Per sender, metric and hour/day bucket aggregates, maintained on ingest
+    (
+        """
+        CREATE TABLE IF NOT EXISTS rollups (
+            source_hash_hex TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket REAL NOT NULL,
+            metric TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            min REAL NOT NULL,
+            max REAL NOT NULL,
+            sum REAL NOT NULL,
+            last REAL NOT NULL,
+            last_at REAL NOT NULL,
+            PRIMARY KEY (source_hash_hex, resolution, bucket, metric)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rollups_bucket ON rollups (resolution, bucket)",
+        lambda conn: _backfill_rollups(conn),
+    ),
+    # Network summary per reading that carried rns_transport stats, with the
+    # absolute counters the next reading's deltas are taken from
+    (
+        """
+        CREATE TABLE IF NOT EXISTS net_summary (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_hash_hex TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            transport INTEGER NOT NULL,
+            rx_bytes INTEGER,
+            tx_bytes INTEGER,
+            codec TEXT NOT NULL,
+            summary BLOB NOT NULL,
+            counters TEXT NOT NULL,
+            raw_codec TEXT,
+            raw BLOB
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_net_summary_source_time ON net_summary (source_hash_hex, updated_at)",
+    ),
+    # Every reported position, and each sender's latest one, with R*Tree
+    # indexes kept in step by triggers. The R*Tree stores 32-bit floats rounded
+    # outwards, so it yields a superset that queries refine on the real columns.
+    (
+        """
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_hash_hex TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            altitude REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_locations_source_time ON locations (source_hash_hex, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_locations_time ON locations (updated_at)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon, min_time, max_time)",
+        """
+        CREATE TRIGGER IF NOT EXISTS locations_insert AFTER INSERT ON locations BEGIN
+            INSERT INTO locations_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude,
+                                                new.updated_at, new.updated_at);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS locations_delete AFTER DELETE ON locations BEGIN
+            DELETE FROM locations_rtree WHERE id = old.id;
+        END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS last_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_hash_hex TEXT NOT NULL UNIQUE,
+            updated_at REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            altitude REAL
+        )
+        """,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS last_locations_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+        """
+        CREATE TRIGGER IF NOT EXISTS last_locations_insert AFTER INSERT ON last_locations BEGIN
+            INSERT INTO last_locations_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS last_locations_update AFTER UPDATE ON last_locations BEGIN
+            UPDATE last_locations_rtree SET min_lat = new.latitude, max_lat = new.latitude,
+                                            min_lon = new.longitude, max_lon = new.longitude WHERE id = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS last_locations_delete AFTER DELETE ON last_locations BEGIN
+            DELETE FROM last_locations_rtree WHERE id = old.id;
+        END
+        """,
+        lambda conn: _backfill_locations(conn),
+    ),
+    # Payload size in bytes, in a covering index with the sender and time so
+    # per-sender counts, ranges and sizes never read the table itself
+    (
+        "ALTER TABLE telemetry ADD COLUMN size INTEGER",
+        "UPDATE telemetry SET size = LENGTH(CAST(payload AS BLOB))",
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_source_time_size ON telemetry (source_hash_hex, updated_at, size)",
+        "DROP INDEX IF EXISTS idx_telemetry_source_time",
+    ),
+]
+
+def _backfill_rollups(conn, batch=1000):
+    cur = conn.execute("SELECT source_hash_hex, updated_at, codec, payload FROM telemetry WHERE updated_at IS NOT NULL")
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        updates = []
+        for source_hash, updated_at, name, payload in rows:
+            updates += rollup.rows(source_hash, updated_at, codec.decode(payload, name))
+        conn.executemany(rollup.UPSERT_ROLLUP, updates)
+
+def _backfill_locations(conn, batch=1000):
+    cur = conn.execute(
+        "SELECT source_hash_hex, updated_at, codec, payload FROM telemetry WHERE updated_at IS NOT NULL ORDER BY id"
+    )
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        positions = _positions((source_hash, updated_at, codec.decode(payload, name))
+                               for source_hash, updated_at, name, payload in rows)
+        conn.executemany(INSERT_LOCATION, positions)
+        conn.executemany(UPSERT_LAST_LOCATION, positions)
+
+def _positions(readings):
+    positions = []
+    for source_hash, updated_at, data in readings:
+        fix = geo.position(data)
+        if fix is not None:
+            positions.append((source_hash, updated_at, *fix))
+    return positions
+
+INSERT_TELEMETRY = """
+    INSERT INTO telemetry (source_hash_hex, updated_at, codec, payload, size)
+    VALUES (?1, ?2, ?3, ?4, LENGTH(CAST(?4 AS BLOB)))
+"""
+INSERT_LOCATION = "INSERT INTO locations (source_hash_hex, updated_at, latitude, longitude, altitude) VALUES (?, ?, ?, ?, ?)"
+UPSERT_LAST_LOCATION = """
+    INSERT INTO last_locations (source_hash_hex, updated_at, latitude, longitude, altitude) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (source_hash_hex) DO UPDATE SET
+        updated_at = excluded.updated_at, latitude = excluded.latitude,
+        longitude = excluded.longitude, altitude = excluded.altitude
+    WHERE excluded.updated_at >= last_locations.updated_at
+"""
+INSERT_NET_SUMMARY = """
+    INSERT INTO net_summary (source_hash_hex, updated_at, transport, rx_bytes, tx_bytes, codec, summary, counters,
+                             raw_codec, raw)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SELECT_HISTORY = """
+    SELECT codec, payload, updated_at FROM telemetry
+    WHERE source_hash_hex=? ORDER BY updated_at DESC LIMIT ?
+"""
+
+_db_path = TELEMETRY_DB_PATH
+_local = threading.local()
+_conns = []
+_conns_lock = threading.Lock()
+_generation = 0
+_buffer = None
+cache = HistoryCache(CACHE_PER_SENDER, CACHE_MAX_SENDERS, CACHE_MAX_BYTES)
+
+def _last_counters(source_hash):
+    row = get_conn().execute(
+        "SELECT counters FROM net_summary WHERE source_hash_hex=? ORDER BY updated_at DESC LIMIT 1", (source_hash,)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+net_tracker = netstats.Tracker(NETSTATS_MAX_SENDERS, _last_counters)
+
+def _connect():
+    # check_same_thread is off only so close() can shut every connection down
+    # from the main thread; each connection is otherwise used by one thread.
+    conn = sqlite3.connect(_db_path, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
 
 def get_conn():
-    return sqlite3.connect(TELEMETRY_DB_PATH)
-
-def init_db():
-    with get_conn() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS telemetry (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                source_hash_hex TEXT NOT NULL,
-                telemetry_json TEXT NOT NULL,
-                updated_at REAL
-            )
-        """)
+    if getattr(_local, "generation", None) != _generation:
+        conn = _connect()
+        with _conns_lock:
+            _conns.append(conn)
+        _local.conn, _local.generation = conn, _generation
+    return _local.conn
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, len(MIGRATIONS) + 1):
+        conn.execute("BEGIN")
+        try:
+            for step in MIGRATIONS[target - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Migrated telemetry DB to schema version %s", target)
+
+def adopt_legacy(path, legacy=LEGACY_DB_PATH):
+    """Seeds a new database at path from echo_ai.py's telemetry.db.
+
+    A database echo_ai.py still reads is copied, and the migrations then
+    convert the copy. One an earlier version of this package had already
+    migrated in place is moved instead, since echo_ai.py can't read it; it
+    starts a fresh telemetry.db.
+    """
+    if os.path.exists(path) or not os.path.exists(legacy):
+        return
+    src = sqlite3.connect(legacy)
+    try:
+        version = src.execute("PRAGMA user_version").fetchone()[0]
+        if version < 3:
+            dst = sqlite3.connect(path)
+            with dst:
+                src.backup(dst)
+            dst.close()
+            logger.info("Copied %s into %s", legacy, path)
+            return
+        src.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        src.close()
+    os.replace(legacy, path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(legacy + suffix):
+            os.remove(legacy + suffix)
+    logger.info("Moved %s, already converted for this package, to %s", legacy, path)
+
+def init_db(path=None, write_behind=WRITE_BEHIND):
+    global _db_path, _buffer
+    if path:
+        _db_path = path
+    else:
+        adopt_legacy(_db_path)
+    migrate(get_conn())
+    if write_behind and _buffer is None:
+        _buffer = WriteBehind(save_many, WRITE_BATCH_SIZE, WRITE_MAX_STALENESS_MS,
+                              WRITE_MAX_RETRIES, WRITE_MAX_PENDING)
+        _buffer.start()
     logger.info("Telemetry DB initialized.")
 
+def checkpoint(mode="PASSIVE"):
+    get_conn().execute(f"PRAGMA wal_checkpoint({mode})")
+
+def close():
+    global _generation, _buffer
+    if _buffer is not None:
+        _buffer.stop(flush=WRITE_FLUSH_ON_SHUTDOWN)
+        _buffer = None
+    with _conns_lock:
+        conns = list(_conns)
+        _conns.clear()
+        _generation += 1
+    for i, conn in enumerate(conns):
+        try:
+            if i == 0:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error("Error closing DB connection: %s", e)
+    logger.info("Telemetry DB closed.")
+
+def stats():
+    return {
+        "history_cache": cache.stats(),
+        "write_behind_depth": _buffer.depth() if _buffer is not None else 0,
+        "write_behind_dropped": _buffer.dropped if _buffer is not None else 0,
+    }
+
 def serialize(data):
     return json.dumps(data, default=safe_json)
 
+def make_row(source_hash, updated_at, data):
+    """Storage row for one reading, (source, updated_at, codec, payload, net, data),
+    and the plain data that was encoded.
+
+    A raw rns_transport blob is swapped for its summary in the payload; net
+    holds the net_summary columns after the first two, or None. data is the
+    plain data again, so save_many derives rollups and positions from it
+    instead of decoding the payload.
+    """
+    data = to_plain(data)
+    net = None
+    stats = data.get(25) if isinstance(data, dict) else None
+    if netstats.is_raw(stats):
+        summary, counters = net_tracker.summarize(source_hash, stats)
+        raw_codec, raw = None, None
+        if NETSTATS_RAW == "compress":
+            raw_codec, raw = codec.encode(stats, "msgpack", STORAGE_COMPRESSION or "zlib")
+        if NETSTATS_RAW != "keep":
+            data = {**data, 25: summary}
+        net = (summary["transport"], summary.get("rx_bytes"), summary.get("tx_bytes"),
+               *codec.encode(summary, STORAGE_CODEC, STORAGE_COMPRESSION, STORAGE_COMPRESS_MIN_BYTES),
+               json.dumps(counters, separators=(",", ":")), raw_codec, raw)
+    name, payload = codec.encode(data, STORAGE_CODEC, STORAGE_COMPRESSION, STORAGE_COMPRESS_MIN_BYTES)
+    return (source_hash, updated_at, name, payload, net, data), data
+
+def save_many(rows):
+    updates, summaries, readings = [], [], []
+    for source_hash, updated_at, name, payload, net, data in rows:
+        updates += rollup.rows(source_hash, updated_at, data)
+        readings.append((source_hash, updated_at, data))
+        if net is not None:
+            summaries.append((source_hash, updated_at) + net)
+    positions = _positions(readings)
+    conn = get_conn()
+    with conn:
+        conn.executemany(INSERT_TELEMETRY, [row[:4] for row in rows])
+        conn.executemany(rollup.UPSERT_ROLLUP, updates)
+        conn.executemany(INSERT_NET_SUMMARY, summaries)
+        conn.executemany(INSERT_LOCATION, positions)
+        conn.executemany(UPSERT_LAST_LOCATION, positions)
+    logger.info("Telemetry rows written", extra=kv("telemetry", stage="save_many", rows=len(rows)))
+
 def save(source_hash, data):
-    telemetry_json = serialize(data)
-    with get_conn() as conn:
-        conn.execute(
-            "INSERT INTO telemetry (source_hash_hex, telemetry_json, updated_at) VALUES (?, ?, ?)",
-            (source_hash, telemetry_json, time.time())
-        )
-    logger.info(f"Saved telemetry for {source_hash} ({len(telemetry_json)} bytes)")
+    row, data = make_row(source_hash, time.time(), data)
+    name, payload = row[2], row[3]
+    if _buffer is not None:
+        _buffer.add(row)
+    else:
+        save_many([row])
+    # Cache what a DB read would return, so hits and misses look the same
+    cached = data if codec.is_lossless(name) else codec.decode(payload, name)
+    cache.add(source_hash, row[1], cached, len(payload))
+    logger.info("Telemetry saved", extra=kv("telemetry", sender=source_hash[:5], stage="save", bytes=len(payload), codec=name))
+
+def load_seen(since):
+    return [(r["hash"], r["seen_at"]) for r in
+            get_conn().execute("SELECT hash, seen_at FROM seen_messages WHERE seen_at >= ?", (since,))]
+
+def store_seen(entries):
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM seen_messages")
+        conn.executemany("INSERT INTO seen_messages (hash, seen_at) VALUES (?, ?)", entries)
+
+def outbox_put(destination, content, expires_at):
+    conn = get_conn()
+    with conn:
+        conn.execute("INSERT INTO outbox (destination_hex, content, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                     (destination, content, time.time(), expires_at))
+
+def outbox_for(destination, now):
+    return get_conn().execute(
+        "SELECT id, content, attempts FROM outbox WHERE destination_hex=? AND expires_at > ? ORDER BY id",
+        (destination, now)
+    ).fetchall()
+
+def outbox_attempted(row_id):
+    conn = get_conn()
+    with conn:
+        conn.execute("UPDATE outbox SET attempts = attempts + 1 WHERE id=?", (row_id,))
+
+def outbox_delete(ids):
+    conn = get_conn()
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id=?", [(i,) for i in ids])
+
+def outbox_count(destination, now):
+    return get_conn().execute(
+        "SELECT COUNT(*) FROM outbox WHERE destination_hex=? AND expires_at > ?", (destination, now)
+    ).fetchone()[0]
+
+def outbox_counts(now):
+    return [(r[0], r[1]) for r in get_conn().execute(
+        "SELECT destination_hex, COUNT(*) FROM outbox WHERE expires_at > ? GROUP BY destination_hex", (now,))]
+
+def outbox_expire(now):
+    conn = get_conn()
+    with conn:
+        return conn.execute("DELETE FROM outbox WHERE expires_at <= ?", (now,)).rowcount
+
+def delete_expired(cutoff, batch):
+    conn = get_conn()
+    deleted = 0
+    with conn:
+        for table in ("telemetry", "net_summary", "locations", "last_locations"):
+            deleted += conn.execute(f"""
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM {table} WHERE updated_at < ? LIMIT ?
+                )
+            """, (cutoff, batch)).rowcount
+    return deleted
+
+def load_net_summaries(source_hash, since, until=None):
+    """Network summaries of a sender's readings in a time range, oldest first."""
+    return [{"updated_at": r["updated_at"], **codec.decode(r["summary"], r["codec"])} for r in get_conn().execute("""
+        SELECT updated_at, codec, summary FROM net_summary
+        WHERE source_hash_hex=? AND updated_at >= ? AND updated_at < ? ORDER BY updated_at
+    """, (source_hash, since, until or time.time()))]
+
+def iter_telemetry(source_hash=None, since=None, until=None, batch=1000):
+    """Yields stored readings as (source, updated_at, codec, payload), oldest first.
+
+    Rows are fetched batch at a time from one cursor, so memory stays flat
+    however many rows match. Payloads are returned as stored; pass them to
+    codec.decode to decompress and decode them.
+    """
+    where, params = ["updated_at >= ?", "updated_at < ?"], [since or 0, until or time.time()]
+    if source_hash:
+        where.append("source_hash_hex = ?")
+        params.append(source_hash)
+    cur = get_conn().execute(f"""
+        SELECT source_hash_hex, updated_at, codec, payload FROM telemetry
+        WHERE {" AND ".join(where)} ORDER BY updated_at
+    """, params)
+    try:
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+    finally:
+        cur.close()
+
+def source_stats(source_hash):
+    """(rows, first, last, payload bytes) of one sender, read from its covering index range."""
+    return tuple(get_conn().execute("""
+        SELECT COUNT(*), MIN(updated_at), MAX(updated_at), COALESCE(SUM(size), 0)
+        FROM telemetry WHERE source_hash_hex=?
+    """, (source_hash,)).fetchone())
+
+def next_source(after):
+    row = get_conn().execute(
+        "SELECT source_hash_hex FROM telemetry WHERE source_hash_hex > ? ORDER BY source_hash_hex LIMIT 1",
+        (after,)
+    ).fetchone()
+    return row[0] if row else None
+
+def trim_source(source_hash, keep, batch):
+    conn = get_conn()
+    row = conn.execute("""
+        SELECT updated_at FROM telemetry WHERE source_hash_hex=?
+        ORDER BY updated_at DESC LIMIT 1 OFFSET ?
+    """, (source_hash, keep)).fetchone()
+    if row is None:
+        return 0
+    with conn:
+        cur = conn.execute("""
+            DELETE FROM telemetry WHERE id IN (
+                SELECT id FROM telemetry WHERE source_hash_hex=? AND updated_at <= ? LIMIT ?
+            )
+        """, (source_hash, row[0], batch))
+    return cur.rowcount
+
+def delete_rollups(resolution, cutoff, batch):
+    conn = get_conn()
+    with conn:
+        cur = conn.execute("""
+            DELETE FROM rollups WHERE (source_hash_hex, resolution, bucket, metric) IN (
+                SELECT source_hash_hex, resolution, bucket, metric FROM rollups
+                WHERE resolution=? AND bucket < ? LIMIT ?
+            )
+        """, (resolution, cutoff, batch))
+    return cur.rowcount
+
+def load_rollups(source_hash, resolution, since, until=None, metric=None):
+    """Raw buckets for a time range, oldest first, as dicts with a mean added."""
+    query = """
+        SELECT bucket, metric, count, min, max, sum / count AS mean, last FROM rollups
+        WHERE source_hash_hex=? AND resolution=? AND bucket >= ? AND bucket < ?
+    """
+    params = [source_hash, resolution, since - since % resolution, until or time.time()]
+    if metric:
+        query += " AND metric=?"
+        params.append(metric)
+    return [dict(r) for r in get_conn().execute(query + " ORDER BY bucket, metric", params)]
+
+def load_trends(source_hash, until=None, windows=TREND_WINDOWS):
+    """Per metric aggregates over each window ending at until.
+
+    Returns {metric: {label: (count, min, mean, max)}}. Short windows are read
+    from hourly buckets and long ones from daily buckets, so a window may
+    reach back up to one bucket further than its nominal length.
+    """
+    until = until or time.time()
+    conn = get_conn()
+    trends = {}
+    for label, window in windows:
+        resolution = rollup.resolution_for(window)
+        since = until - window
+        for r in conn.execute("""
+            SELECT metric, SUM(count), MIN(min), SUM(sum) / SUM(count), MAX(max) FROM rollups
+            WHERE source_hash_hex=? AND resolution=? AND bucket >= ? AND bucket < ?
+            GROUP BY metric
+        """, (source_hash, resolution, since - since % resolution, until)):
+            trends.setdefault(r[0], {})[label] = tuple(r[1:])
+    return trends
+
+def _location_rows(query, params):
+    return [{"source": r[0], "updated_at": r[1], "latitude": r[2], "longitude": r[3], "altitude": r[4]}
+            for r in get_conn().execute(query, params)]
+
+def locations_in(min_lat, min_lon, max_lat, max_lon, since=None, until=None, limit=1000):
+    """Positions reported inside a bounding box and time window, newest first.
+
+    The R*Tree narrows the search down to the box and window; the real
+    columns are checked again because the index rounds its bounds outwards.
+    """
+    since = since if since is not None else 0
+    until = until if until is not None else time.time()
+    return _location_rows("""
+        SELECT l.source_hash_hex, l.updated_at, l.latitude, l.longitude, l.altitude
+        FROM locations_rtree r JOIN locations l ON l.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+          AND r.max_time >= ? AND r.min_time <= ?
+          AND l.latitude BETWEEN ? AND ? AND l.longitude BETWEEN ? AND ? AND l.updated_at BETWEEN ? AND ?
+        ORDER BY l.updated_at DESC LIMIT ?
+    """, (min_lat, max_lat, min_lon, max_lon, since, until,
+          min_lat, max_lat, min_lon, max_lon, since, until, limit))
+
+def nearest(lat, lon, n=5, since=None, exclude=None, radius=1000):
+    """The n senders whose latest position is closest to (lat, lon), nearest first.
+
+    Searches a box around the point that grows fourfold until it holds n
+    senders within its inscribed circle, so only nearby rows are read.
+    Each result carries its distance in metres.
+    """
+    since = since if since is not None else 0
+    while True:
+        min_lat, min_lon, max_lat, max_lon = geo.bbox(lat, lon, radius)
+        found = []
+        for row in _location_rows("""
+            SELECT l.source_hash_hex, l.updated_at, l.latitude, l.longitude, l.altitude
+            FROM last_locations_rtree r JOIN last_locations l ON l.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? AND l.updated_at >= ?
+        """, (min_lat, max_lat, min_lon, max_lon, since)):
+            if row["source"] != exclude:
+                row["distance"] = geo.distance(lat, lon, row["latitude"], row["longitude"])
+                found.append(row)
+        found.sort(key=lambda r: r["distance"])
+        whole_earth = min_lon <= -180 and max_lon >= 180 and min_lat <= -90 and max_lat >= 90
+        if whole_earth or (len(found) >= n and found[n - 1]["distance"] <= radius):
+            return found[:n]
+        radius *= 4
 
 def load_history(source_hash, limit=5):
-    with get_conn() as conn:
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute("""
-            SELECT telemetry_json, updated_at FROM telemetry
-            WHERE source_hash_hex=? ORDER BY updated_at DESC LIMIT ?
-        """, (source_hash, limit)).fetchall()
+    history = cache.get(source_hash, limit)
+    if history is not None:
+        return history
+
+    # Snapshot unflushed rows before querying so a batch committed in between
+    # shows up in at least one of the two; duplicates are dropped by timestamp.
+    pending = _buffer.pending(lambda row: row[0] == source_hash) if _buffer is not None else []
+    rows = [(r["updated_at"], r["codec"], r["payload"])
+            for r in get_conn().execute(SELECT_HISTORY, (source_hash, limit)).fetchall()]
+    if pending:
+        stored = {r[0] for r in rows}
+        rows += [row[1:4] for row in pending if row[1] not in stored]
+        rows.sort(key=lambda r: r[0], reverse=True)
+        del rows[limit:]
 
     history = []
-    for r in rows:
-        history.append({"updated_at": r["updated_at"], "data": json.loads(r["telemetry_json"])})
+    for updated_at, name, payload in rows:
+        history.append({"updated_at": updated_at, "data": codec.decode(payload, name)})
+    cache.fill(source_hash, history, [len(r[2]) for r in rows], limit)
     return history
+
+def convert(target, compression=None, compress_min=0, batch=1000):
+    """Re-encodes stored rows with the target codec, one batch per transaction."""
+    conn = get_conn()
+    last_id, converted = 0, 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, codec, payload FROM telemetry WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+        ).fetchall()
+        if not rows:
+            return converted
+        updates = []
+        for r in rows:
+            data = codec.decode(r["payload"], r["codec"])
+            if not codec.is_lossless(r["codec"]):
+                data = codec.restore_keys(data)
+            name, payload = codec.encode(data, target, compression, compress_min)
+            if name != r["codec"] or payload != r["payload"]:
+                updates.append((name, payload, r["id"]))
+        with conn:
+            conn.executemany("UPDATE telemetry SET codec=?1, payload=?2, size=LENGTH(CAST(?2 AS BLOB)) WHERE id=?3", updates)
+        converted += len(updates)
+        last_id = rows[-1]["id"]
+        logger.info("Converted %s rows (up to id %s)", converted, last_id)
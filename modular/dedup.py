@@ -0,0 +1,100 @@
+import re, threading, time
+from collections import OrderedDict
+
+
+class SeenMessages:
+    """Bounded, time-expiring set of LXMF message hashes already accepted."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.duplicates = 0
+        self._seen = OrderedDict()  # hash -> first seen, oldest first
+        self._lock = threading.Lock()
+
+    def check(self, message_hash):
+        """Records message_hash and returns True if it was already seen."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if message_hash in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[message_hash] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, message_hash):
+        """Un-records message_hash, so a redelivery is handled again."""
+        with self._lock:
+            self._seen.pop(message_hash, None)
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        while self._seen:
+            message_hash, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff:
+                break
+            del self._seen[message_hash]
+
+    def load(self, entries):
+        with self._lock:
+            for message_hash, seen_at in sorted(entries, key=lambda e: e[1]):
+                self._seen[message_hash] = seen_at
+            self._expire(time.time())
+
+    def entries(self):
+        with self._lock:
+            self._expire(time.time())
+            return list(self._seen.items())
+
+    def __len__(self):
+        return len(self._seen)
+
+
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!.").lower()
+
+def fingerprint(history):
+    return (history[0]["updated_at"], len(history)) if history else None
+
+
+class ReplyCache:
+    """Short-lived answers keyed on (sender, normalized query, telemetry fingerprint)."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._replies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._replies.get(key)
+            if item is None or item[1] < time.monotonic():
+                self._replies.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._replies[key] = (reply, time.monotonic() + self.ttl)
+            self._replies.move_to_end(key)
+            while len(self._replies) > self.max_entries:
+                self._replies.popitem(last=False)
+
+    def expire(self):
+        # Every entry has the same ttl, so the oldest entries expire first
+        now = time.monotonic()
+        with self._lock:
+            while self._replies and next(iter(self._replies.values()))[1] < now:
+                self._replies.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._replies), "hits": self.hits, "misses": self.misses}
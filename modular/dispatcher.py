@@ -0,0 +1,169 @@
+import threading
+from collections import deque
+import LXMF
+from .utils import logger
+from . import metrics
+
+
+class Job:
+    __slots__ = ("message", "source", "reply", "ingest", "notice")
+
+    def __init__(self, message, source, reply, ingest):
+        self.message = message
+        self.source = source
+        self.reply = reply
+        self.ingest = ingest
+        self.notice = None  # callable sent by the worker before the handler runs, if set
+
+
+class Dispatcher:
+    """Bounded inbound queue in front of the message handler.
+
+    Jobs are queued per sender and senders are served round-robin, so a
+    sender's messages are handled in order while a slow AI call for one
+    sender never blocks the others, and no sender can hold more than
+    max_per_sender queue slots. When too many chat requests are
+    pending the oldest one is shed to ingest-only, so telemetry still
+    lands in the DB while the reply is skipped.
+    """
+
+    def __init__(self, handler, workers, max_depth, max_chat, max_per_sender=None, seen=None, admit=None):
+        self.handler = handler
+        self.seen = seen
+        self.admit = admit
+        self.max_per_sender = max_per_sender or max_depth
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_chat = max_chat
+        self.depth = 0
+        self.chat_depth = 0
+        self.shed = 0
+        self.dropped = 0
+        self._pending = {}        # source -> deque of jobs
+        self._ready = deque()     # sources with queued jobs and no active worker
+        self._active = set()
+        self._chat = deque()      # pending chat jobs in arrival order, for shedding
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"echo-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Dispatcher started with %s workers", self.workers)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def submit(self, message):
+        # Redeliveries (retries, propagation nodes) are dropped before any work.
+        # The hash is recorded here so concurrent redeliveries can't both pass,
+        # and forgotten again if the message isn't queued after all.
+        if self.seen is not None and message.hash and self.seen.check(message.hash):
+            logger.info("Dropping duplicate message")
+            return
+        if not self._enqueue(message) and self.seen is not None and message.hash:
+            self.seen.forget(message.hash)
+
+    def _enqueue(self, message):
+        """Queues a job for message; returns False if it was dropped."""
+        source = message.source_hash
+        try:
+            reply = bool(message.content.strip())
+        except Exception:
+            reply = False
+        job = Job(message, source, reply, LXMF.FIELD_TELEMETRY in message.fields)
+        if not (job.reply or job.ingest):
+            return False
+        if self.admit is not None and not self.admit(job):
+            return False
+
+        with self._cond:
+            queue = self._pending.get(source)
+            if self.depth >= self.max_depth or (queue is not None and len(queue) >= self.max_per_sender):
+                self.dropped += 1
+                logger.warning("Inbound queue full (%s), dropping message", self.depth)
+                return False
+            if job.reply:
+                if self.chat_depth >= self.max_chat:
+                    self._shed_oldest_chat()
+                self._chat.append(job)
+                self.chat_depth += 1
+
+            if queue is None:
+                queue = self._pending[source] = deque()
+            queue.append(job)
+            self.depth += 1
+            if source not in self._active and len(queue) == 1:
+                self._ready.append(source)
+            self._cond.notify()
+        return True
+
+    def _shed_oldest_chat(self):
+        job = self._chat.popleft()
+        job.reply = False
+        self.chat_depth -= 1
+        self.shed += 1
+        logger.warning("Too many pending chat requests, shedding oldest to ingest-only")
+
+    def _next(self):
+        with self._cond:
+            while self._running and not self._ready:
+                self._cond.wait()
+            if not self._ready:
+                return None
+            source = self._ready.popleft()
+            job = self._pending[source].popleft()
+            self._active.add(source)
+            self.depth -= 1
+            if job.reply:
+                self.chat_depth -= 1
+                self._chat.remove(job)
+            return job
+
+    def _done(self, source):
+        with self._cond:
+            self._active.discard(source)
+            if self._pending[source]:
+                self._ready.append(source)
+                self._cond.notify()
+            else:
+                del self._pending[source]
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            if job.notice is not None:
+                try:
+                    job.notice()
+                except Exception as e:
+                    logger.error("Could not send notice: %s", e)
+            try:
+                if job.reply or job.ingest:
+                    self.handler(job.message, reply=job.reply, ingest=job.ingest)
+            except Exception as e:
+                metrics.error("handler", e)
+                logger.error("Handler failed: %s", e)
+            finally:
+                self._done(job.source)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": self.depth,
+                "chat_depth": self.chat_depth,
+                "senders": len(self._pending),
+                "shed": self.shed,
+                "dropped": self.dropped,
+                "duplicates": self.seen.duplicates if self.seen is not None else 0,
+            }
@@ -0,0 +1,118 @@
+import csv, json, sys, time
+from .telemetry import SCHEMA, to_named, _sid
+from .utils import logger, safe_json
+
+SENSOR_IDS = {cls.name: sid for sid, cls in SCHEMA.items()}
+
+
+def sensor_id(value):
+    """Sensor id from a number or a sensor name such as "location"."""
+    sid = _sid(value)
+    if sid in SENSOR_IDS:
+        return SENSOR_IDS[sid]
+    if not isinstance(sid, int):
+        raise ValueError(f"unknown sensor {value!r}, expected one of {', '.join(SENSOR_IDS)} or a number")
+    return sid
+
+def records(rows, sensors=None, raw=False):
+    """(source, updated_at, telemetry) per stored row, decoded unless raw.
+
+    Decoded telemetry is keyed by sensor name. With sensors only those
+    sensors are kept, and rows carrying none of them are skipped; raw rows
+    cannot be filtered and keep their stored payload and codec as is.
+    """
+    from . import codec
+    for source, updated_at, name, payload in rows:
+        if raw:
+            yield source, updated_at, {"codec": name, "payload": payload.hex()}
+            continue
+        data = codec.decode(payload, name)
+        if sensors:
+            data = {sid: value for sid, value in data.items() if _sid(sid) in sensors}
+            if not data:
+                continue
+        yield source, updated_at, to_named(data)
+
+def write_ndjson(records, out):
+    count = 0
+    for source, updated_at, telemetry in records:
+        out.write(json.dumps({"source": source, "time": updated_at, "telemetry": telemetry},
+                             separators=(",", ":"), default=safe_json))
+        out.write("\n")
+        count += 1
+    return count
+
+def write_csv(records, out):
+    """One CSV line per field, so the columns are the same for every sensor."""
+    from .prompt import flatten
+    writer = csv.writer(out)
+    writer.writerow(("source", "time", "field", "value"))
+    count = 0
+    for source, updated_at, telemetry in records:
+        for path, value in flatten(telemetry).items():
+            writer.writerow((source, updated_at, path, safe_json(value) if isinstance(value, bytes) else value))
+        count += 1
+    return count
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv}
+
+def main(args):
+    from .db import init_db, close as close_db, iter_telemetry
+    if args.raw and args.sensor:
+        raise SystemExit("--sensor needs decoded payloads and cannot be combined with --raw")
+    sensors = set(args.sensor) if args.sensor else None
+    init_db(write_behind=False)
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output != "-" else sys.stdout
+    started = time.monotonic()
+    rows = iter_telemetry(args.sender, args.since, args.until, args.batch)
+    try:
+        count = WRITERS[args.format](records(rows, sensors, args.raw), out)
+        logger.info("Exported %s readings in %.1fs", count, time.monotonic() - started)
+    finally:
+        rows.close()
+        if out is not sys.stdout:
+            out.close()
+        close_db()
+
+def add_arguments(parser):
+    parser.add_argument("--format", default="ndjson", choices=sorted(WRITERS))
+    parser.add_argument("--output", "-o", default="-", help="output file, or - for stdout")
+    parser.add_argument("--sender", help="only readings from this source hash (hex)")
+    parser.add_argument("--since", type=float, help="only readings at or after this UNIX timestamp")
+    parser.add_argument("--until", type=float, help="only readings before this UNIX timestamp")
+    parser.add_argument("--sensor", action="append", type=sensor_id, help="only this sensor, by name or number; repeatable")
+    parser.add_argument("--raw", action="store_true", help="write payloads as stored (hex) without decoding")
+    parser.add_argument("--batch", type=int, default=1000, help="rows fetched per round trip")
+
+def _stamp(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) if ts is not None else "-"
+
+def report(args):
+    """Per sender row counts, time ranges and payload sizes.
+
+    Senders are walked through the (source, time) index and each one is
+    aggregated over its own index range, so no query scans the whole table.
+    """
+    from .db import init_db, close as close_db, next_source, source_stats
+    init_db(write_behind=False)
+    try:
+        senders = [args.sender] if args.sender else _senders(next_source)
+        total_rows = total_bytes = 0
+        print(f"{'sender':32}  {'rows':>9}  {'bytes':>12}  {'first':19}  {'last':19}")
+        for source in senders:
+            rows, first, last, size = source_stats(source)
+            total_rows += rows
+            total_bytes += size
+            print(f"{source:32}  {rows:>9}  {size:>12}  {_stamp(first):19}  {_stamp(last):19}")
+        print(f"{'total':32}  {total_rows:>9}  {total_bytes:>12}")
+    finally:
+        close_db()
+
+def _senders(next_source):
+    source = next_source("")
+    while source is not None:
+        yield source
+        source = next_source(source)
+
+def add_stats_arguments(parser):
+    parser.add_argument("--sender", help="only this source hash (hex)")
@@ -0,0 +1,39 @@
+import math
+from .telemetry import to_named
+
+EARTH_RADIUS = 6371008.8  # metres, mean
+
+
+def position(data):
+    """(latitude, longitude, altitude) of a reading, or None without a valid fix."""
+    location = to_named(data).get("location")
+    if not isinstance(location, dict):
+        return None
+    lat, lon = location.get("latitude"), location.get("longitude")
+    if not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon, location.get("altitude")
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox(lat, lon, radius):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing a circle of radius metres.
+
+    Near the poles, or when the circle crosses the antimeridian, the box
+    widens to every longitude instead of wrapping.
+    """
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    if min_lat <= -90 or max_lat >= 90:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = math.degrees(radius / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    if lon - dlon < -180 or lon + dlon > 180:
+        return min_lat, -180.0, max_lat, 180.0
+    return min_lat, lon - dlon, max_lat, lon + dlon
@@ -0,0 +1,87 @@
+import json, sqlite3, time
+from .telemetry import decode
+from .utils import logger
+
+# Sideband keeps received telemetry as packed msgpack in its own database
+SIDEBAND_QUERY = "SELECT dest_context, ts, data FROM telemetry ORDER BY ts"
+
+
+def read_sideband(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cur = conn.execute(SIDEBAND_QUERY)
+        while True:
+            rows = cur.fetchmany(1000)
+            if not rows:
+                return
+            for source, ts, packed in rows:
+                yield source.hex() if isinstance(source, bytes) else source, ts, packed
+    finally:
+        conn.close()
+
+def read_ndjson(path):
+    """One JSON object per line: {"source": hex, "time": unix, "telemetry": hex msgpack or object}."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            telemetry = record["telemetry"]
+            if isinstance(telemetry, str):
+                telemetry = bytes.fromhex(telemetry)
+            yield record["source"], record["time"], telemetry
+
+READERS = {"sideband": read_sideband, "ndjson": read_ndjson}
+
+def to_row(source, ts, telemetry):
+    # Imported on use, so parsing arguments stays light
+    from .codec import msgpack
+    from .db import make_row
+    if isinstance(telemetry, bytes):
+        telemetry = msgpack.unpackb(telemetry, strict_map_key=False)
+    return make_row(source, float(ts), decode(telemetry))[0]
+
+def import_records(records, batch=5000, since=None):
+    """Writes records through save_many, one transaction per batch.
+
+    Returns (imported, skipped); records that fail to decode are skipped.
+    """
+    from .db import save_many
+    imported, skipped, rows = 0, 0, []
+    started = time.monotonic()
+    for source, ts, telemetry in records:
+        if since is not None and ts < since:
+            continue
+        try:
+            rows.append(to_row(source, ts, telemetry))
+        except Exception as e:
+            skipped += 1
+            logger.warning("Skipping record from %s at %s: %s", str(source)[:5], ts, e)
+            continue
+        if len(rows) >= batch:
+            save_many(rows)
+            imported += len(rows)
+            rows = []
+            elapsed = time.monotonic() - started
+            logger.info("Imported %s rows (%.0f rows/s), %s skipped", imported, imported / elapsed, skipped)
+    if rows:
+        save_many(rows)
+        imported += len(rows)
+    return imported, skipped
+
+def main(args):
+    from .db import init_db, close as close_db
+    init_db(write_behind=False)
+    try:
+        records = READERS[args.format](args.path)
+        imported, skipped = import_records(records, args.batch, args.since)
+        logger.info("Import finished: %s rows imported, %s skipped", imported, skipped)
+    finally:
+        close_db()
+
+def add_arguments(parser):
+    parser.add_argument("path", help="Sideband database or NDJSON file")
+    parser.add_argument("--format", default="sideband", choices=sorted(READERS))
+    parser.add_argument("--batch", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--since", type=float, help="skip readings older than this UNIX timestamp")
@@ -1,59 +1,116 @@
+import time
+from functools import partial
 import RNS, LXMF, RNS.vendor.umsgpack as msgpack
-from .db import save, load_history
-from .telemetry import decode
-from .ai_handler import get_reply
-from .utils import logger
+from .db import save, load_history, load_trends, nearest, serialize
+from .telemetry import decode, to_plain
+from .ai_handler import get_reply, UNAVAILABLE_REPLY, BREAKER_REPLY
+from .config import (REPLY_CACHE_MAX, REPLY_CACHE_TTL, REPLY_TITLE, AI_STREAMING,
+                     NEARBY_COUNT, NEARBY_MAX_AGE)
+from .dedup import ReplyCache, normalize_query, fingerprint
+from .shaping import plan
+from .geo import position
+from .utils import logger, kv, lazy
+from . import metrics
 
+replies = ReplyCache(REPLY_CACHE_MAX, REPLY_CACHE_TTL)
 
-def handle_incoming(message, local_destination, message_router):
+
+def unpack_telemetry(field):
+    return msgpack.unpackb(field, strict_map_key=False)
+
+def load_nearby(source, history):
+    """Other senders closest to the newest position in history, if it has one."""
+    fix = position(history[0]["data"]) if history else None
+    if fix is None:
+        return None
+    return nearest(fix[0], fix[1], NEARBY_COUNT, since=time.time() - NEARBY_MAX_AGE, exclude=source)
+
+def handle_incoming(message, local_destination, message_router, reply=True, ingest=True, outbox=None):
     source = RNS.hexrep(message.source_hash, delimit=False)
-    logger.info(f"Message from {source[:5]}")
     try:
         text = message.content.decode("utf-8").strip()
     except Exception:
-        logger.error("Could not decode message content.")
+        logger.error("Could not decode message content.", extra=kv("message", sender=source[:5]))
         return
+    logger.info("Message received", extra=kv("message", sender=source[:5], chars=len(text), reply=reply))
 
     # Decode and save telemetry
-    if LXMF.FIELD_TELEMETRY in message.fields:
+    if ingest and LXMF.FIELD_TELEMETRY in message.fields:
         try:
-            raw = msgpack.unpackb(message.fields[LXMF.FIELD_TELEMETRY], strict_map_key=False)
+            raw = unpack_telemetry(message.fields[LXMF.FIELD_TELEMETRY])
             decoded = decode(raw)
+            # Only serialized if debug logging is on and this record is sampled
+            logger.debug("Decoded telemetry: %s", lazy(lambda: serialize(to_plain(decoded))),
+                         extra=kv("telemetry", sender=source[:5]))
             save(source, decoded)
         except Exception as e:
-            logger.error(f"Telemetry unpack error: {e}")
+            metrics.error("telemetry", e)
+            logger.error("Telemetry unpack error: %s", e)
+
+    # Telemetry-only beacons need neither history nor the AI
+    if not (text and reply):
+        return
 
     # Load history and respond via AI
     history = load_history(source)
-    if text:
-        reply = get_reply(text, history)
-        send_message(source, reply, local_destination, message_router)
+    # Identical question against identical telemetry gets the previous answer
+    key = (source, normalize_query(text), fingerprint(history))
+    answer = replies.get(key)
+    early = []
+    if answer is None:
+        def send_first(chunk):
+            early.append(chunk)
+            send_message(source, chunk, local_destination, message_router, outbox)
+
+        # Trends and nearby nodes are only loaded if a new AI session needs them
+        answer = get_reply(text, history, source, partial(load_trends, source), send_first if AI_STREAMING else None,
+                           nearby=partial(load_nearby, source, history))
+        if answer not in (UNAVAILABLE_REPLY, BREAKER_REPLY):
+            replies.put(key, answer)
+    else:
+        metrics.count("replies.cached")
+    # After an early first chunk only the remainder is left, unless the stream failed
+    if early and answer.startswith(early[0]):
+        answer = answer[len(early[0]):].strip()
+    if answer:
+        send_message(source, answer, local_destination, message_router, outbox)
+
+def send_message(destination_hash, message_content, local_destination, message_router, outbox=None):
+    """Hands a reply to the router; returns True once it has been accepted.
 
-def send_message(destination_hash, message_content, local_destination, message_router):
+    If the recipient's identity is unknown the reply is parked in the outbox
+    (when one is given) and a path request goes out; the outbox delivers it
+    when the recipient's announce or path response arrives.
+    """
+    destination_hex = destination_hash
     try:
         destination_hash = bytes.fromhex(destination_hash)
     except Exception:
         logger.error("Invalid destination hash")
-        return
+        return False
 
     if len(destination_hash) != RNS.Reticulum.TRUNCATED_HASHLENGTH // 8:
         logger.error("Invalid destination hash length")
-        return
+        return False
 
     destination_identity = RNS.Identity.recall(destination_hash)
     if not destination_identity:
         logger.warning("Unknown identity, requesting path...")
+        if outbox is not None:
+            outbox.put(destination_hex, message_content)
         RNS.Transport.request_path(destination_hash)
-        return
+        return False
 
     lxmf_dest = RNS.Destination(destination_identity, RNS.Destination.OUT,
                                  RNS.Destination.SINGLE, "lxmf", "delivery")
-    lxm = LXMF.LXMessage(lxmf_dest, local_destination, message_content,
-                          title="Reply", desired_method=LXMF.LXMessage.DIRECT)
-    lxm.try_propagation_on_fail = True
-
-    try:
-        message_router.handle_outbound(lxm)
-        logger.info(f"Message sent to {destination_hash.hex()}")
-    except Exception as e:
-        logger.error(f"Send failed: {e}")
+    for content, method in plan(destination_hash, message_content, message_router):
+        lxm = LXMF.LXMessage(lxmf_dest, local_destination, content,
+                              title=REPLY_TITLE, desired_method=method)
+        lxm.try_propagation_on_fail = method != LXMF.LXMessage.PROPAGATED
+        try:
+            message_router.handle_outbound(lxm)
+        except Exception as e:
+            logger.error("Send failed: %s", e)
+            return False
+        logger.info("Message sent", extra=kv("send", recipient=destination_hex[:5], chars=len(content), method=method))
+    return True
@@ -0,0 +1,182 @@
+import json, os, threading, time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .utils import logger
+
+# Everything here is a no-op until enable() is called; instrument() wraps
+# the handler's stages only then, so a disabled build pays nothing on the
+# hot path beyond one flag check in count()/observe().
+enabled = False
+
+# Histogram bucket upper bounds: 0.1 ms doubling up to ~52 s for durations
+DURATION_BUCKETS = [0.0001 * 2 ** i for i in range(20)]
+SIZE_BUCKETS = [64 * 2 ** i for i in range(14)]
+
+# Handler collaborators timed by instrument(), named after the functions
+STAGES = ("unpack_telemetry", "decode", "save", "load_history", "get_reply", "send_message", "handle_incoming")
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_started = time.time()
+
+
+class Histogram:
+    __slots__ = ("bounds", "buckets", "count", "total", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+def enable():
+    global enabled
+    enabled = True
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def observe(name, value, bounds=DURATION_BUCKETS):
+    if not enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(bounds)
+        histogram.observe(value)
+
+def error(kind, exc):
+    count(f"errors.{kind}.{type(exc).__name__}")
+
+def gauge(name, fn):
+    """Registers a callable sampled at snapshot time, e.g. a queue depth or a stats() method."""
+    with _lock:
+        _gauges[name] = fn
+
+def timed(stage, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            error(stage, e)
+            raise
+        finally:
+            observe(f"stage.{stage}", time.perf_counter() - start)
+    return wrapper
+
+def instrument():
+    """Wraps the handler's stages with timers; call before the handler is bound."""
+    from . import lxmf_handler
+    for stage in STAGES:
+        setattr(lxmf_handler, stage, timed(stage, getattr(lxmf_handler, stage)))
+
+def snapshot():
+    with _lock:
+        data = {
+            "uptime": time.time() - _started,
+            "counters": dict(_counters),
+            "histograms": {name: h.snapshot() for name, h in _histograms.items()},
+        }
+        gauges = dict(_gauges)
+    data["gauges"] = {}
+    for name, fn in gauges.items():
+        try:
+            data["gauges"][name] = fn()
+        except Exception as e:
+            data["gauges"][name] = f"error: {e}"
+    return data
+
+def write_file(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+class _StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(snapshot(), default=str).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Exporter:
+    """Writes the stats file every `interval` seconds and optionally serves
+    the same snapshot read-only over HTTP on localhost. With interval 0 the
+    caller flushes, e.g. from the scheduler."""
+
+    def __init__(self, path, interval, port=0):
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self._stop = threading.Event()
+        self._server = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        if self.path:
+            try:
+                write_file(self.path)
+            except OSError as e:
+                logger.error("Could not write stats file: %s", e)
+
+    def start(self):
+        if self.interval:
+            threading.Thread(target=self._run, name="echo-metrics", daemon=True).start()
+        if self.port:
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _StatsHandler)
+            threading.Thread(target=self._server.serve_forever, name="echo-metrics-http", daemon=True).start()
+            logger.info("Stats endpoint on http://127.0.0.1:%s/", self.port)
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+        self.flush()
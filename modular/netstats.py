@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+# Per-interface fields worth keeping; Sideband sends many more
+INTERFACE_FIELDS = ("type", "bitrate", "rssi", "snr", "q", "airtime_short", "channel_load_short", "noise_floor")
+
+
+def _round(value, ndigits=1):
+    return round(value, ndigits) if isinstance(value, float) else value
+
+
+def is_raw(stats):
+    """True for the rns_transport blob as Sideband sends it, False for a summary."""
+    return isinstance(stats, dict) and "ifstats" in stats
+
+def _interfaces(stats):
+    ifstats = stats.get("ifstats") or {}
+    interfaces = ifstats.get("interfaces") if isinstance(ifstats, dict) else ifstats
+    return [i for i in interfaces or () if isinstance(i, dict)]
+
+def _name(interface):
+    return str(interface.get("short_name") or interface.get("name") or interface.get("type") or "?")
+
+def counters(stats):
+    """Absolute traffic counters of a raw blob: {"rxb", "txb", "interfaces": {name: [rxb, txb]}}."""
+    return {
+        "rxb": stats.get("traffic_rxb"),
+        "txb": stats.get("traffic_txb"),
+        "interfaces": {_name(i): [i.get("rxb"), i.get("txb")] for i in _interfaces(stats)},
+    }
+
+def _delta(current, previous):
+    if not isinstance(current, (int, float)):
+        return None
+    if not isinstance(previous, (int, float)) or current < previous:
+        # First reading, or the counters were reset by a restart
+        return None
+    return current - previous
+
+def _present(values):
+    return {k: v for k, v in values.items() if v is not None}
+
+def summarize(stats, previous=None):
+    """Compact network summary of a raw rns_transport blob; fields that are
+    unknown are left out.
+
+    Traffic is given as bytes since the previous reading, from `previous`
+    counters; without them (or after a counter reset) there are no deltas.
+    """
+    previous = previous or {}
+    before = previous.get("interfaces") or {}
+    interfaces = []
+    for interface in _interfaces(stats):
+        name = _name(interface)
+        rx, tx = (before.get(name) or (None, None))[:2]
+        entry = {"name": name, "up": bool(interface.get("status"))}
+        entry.update({k: _round(interface[k]) for k in INTERFACE_FIELDS if interface.get(k) is not None})
+        entry["rx_bytes"] = _delta(interface.get("rxb"), rx)
+        entry["tx_bytes"] = _delta(interface.get("txb"), tx)
+        interfaces.append(_present(entry))
+    return _present({
+        "transport": bool(stats.get("transport_enabled")),
+        "uptime": stats.get("transport_uptime"),
+        "rx_speed": _round(stats.get("speed_rx"), None),
+        "tx_speed": _round(stats.get("speed_tx"), None),
+        "rx_bytes": _delta(stats.get("traffic_rxb"), previous.get("rxb")),
+        "tx_bytes": _delta(stats.get("traffic_txb"), previous.get("txb")),
+        "interfaces": interfaces,
+    })
+
+
+class Tracker:
+    """Last traffic counters per sender, for turning counters into deltas.
+
+    Bounded LRU; a sender not in memory is looked up with `load`, which
+    returns its last stored counters or None.
+    """
+
+    def __init__(self, max_senders, load=None):
+        self.max_senders = max_senders
+        self.load = load
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def summarize(self, source, stats):
+        """Returns (summary, counters) and remembers the counters for the next reading."""
+        with self._lock:
+            previous = self._last.get(source)
+        if previous is None and self.load is not None:
+            previous = self.load(source)
+        current = counters(stats)
+        summary = summarize(stats, previous)
+        with self._lock:
+            self._last[source] = current
+            self._last.move_to_end(source)
+            while len(self._last) > self.max_senders:
+                self._last.popitem(last=False)
+        return summary, current
@@ -0,0 +1,127 @@
+import threading, time
+from collections import deque
+from . import db
+from .utils import logger
+
+
+class Outbox:
+    """Replies held back because the recipient's path or identity is unknown.
+
+    Entries live in the DB so they survive restarts. Delivery is driven by
+    RNS announces (including path responses) for the recipient rather than
+    by polling; entries expire after `ttl` seconds or `max_attempts` tries.
+    Flushes run one at a time on a single worker thread, so a destination's
+    replies are never read and delivered twice by overlapping flushes.
+    """
+
+    # RNS announce handler interface
+    aspect_filter = "lxmf.delivery"
+    receive_path_responses = True
+
+    def __init__(self, deliver, ttl, max_attempts):
+        self.deliver = deliver  # deliver(destination_hex, content) -> True once handed to the router
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.delivered = 0
+        self.expired = 0
+        self._waiting = {}  # destination_hex -> queued replies
+        self._lock = threading.Lock()
+        self._queue = deque()     # destinations to flush, each at most once
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        for destination, n in db.outbox_counts(time.time()):
+            self._waiting[destination] = n
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name="echo-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                destination = self._queue.popleft()
+                self._queued.discard(destination)
+            try:
+                self.flush(destination)
+            except Exception as e:
+                logger.error("Outbox flush for %s failed: %s", destination[:5], e)
+
+    def put(self, destination, content):
+        db.outbox_put(destination, content, time.time() + self.ttl)
+        with self._lock:
+            self._waiting[destination] = self._waiting.get(destination, 0) + 1
+        logger.info("Reply to %s held in outbox until a path is known", destination[:5])
+
+    # RNS picks the keyword arguments it passes by counting these parameters,
+    # so the signature must stay exactly this three-argument form
+    def received_announce(self, destination_hash, announced_identity, app_data):
+        destination = destination_hash.hex()
+        with self._lock:
+            if destination not in self._waiting:
+                return
+        # Announce handlers run on the transport thread; deliver off it
+        with self._cond:
+            if destination not in self._queued:
+                self._queued.add(destination)
+                self._queue.append(destination)
+                self._cond.notify()
+
+    def flush(self, destination):
+        now = time.time()
+        done, delivered = [], 0
+        for row in db.outbox_for(destination, now):
+            try:
+                ok = self.deliver(destination, row["content"])
+            except Exception as e:
+                logger.error("Outbox delivery to %s failed: %s", destination[:5], e)
+                ok = False
+            if ok:
+                done.append(row["id"])
+                delivered += 1
+            elif row["attempts"] + 1 >= self.max_attempts:
+                done.append(row["id"])
+                self.expired += 1
+            else:
+                db.outbox_attempted(row["id"])
+        db.outbox_delete(done)
+        with self._lock:
+            self.delivered += delivered
+            remaining = db.outbox_count(destination, now)
+            if remaining:
+                self._waiting[destination] = remaining
+            else:
+                self._waiting.pop(destination, None)
+        if delivered:
+            logger.info("Outbox delivered %s replies to %s", delivered, destination[:5])
+
+    def expire(self):
+        removed = db.outbox_expire(time.time())
+        if removed:
+            self.expired += removed
+            with self._lock:
+                self._waiting = dict(db.outbox_counts(time.time()))
+        return removed
+
+    def depth(self):
+        with self._lock:
+            return sum(self._waiting.values())
+
+    def stats(self):
+        with self._lock:
+            return {"depth": sum(self._waiting.values()), "destinations": len(self._waiting),
+                    "delivered": self.delivered, "expired": self.expired}
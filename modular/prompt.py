@@ -0,0 +1,195 @@
+import json, time
+from .config import PROMPT_BUDGET_CHARS, TREND_BUDGET_CHARS, NEARBY_BUDGET_CHARS
+from .utils import logger, safe_json, kv
+from .telemetry import to_named, legend
+from . import netstats
+from . import metrics
+
+# Decimal places per sensor when rendering floats; GPS needs ~1 m resolution
+PRECISION = {"location": 6}
+DEFAULT_PRECISION = 2
+
+LEGEND = (
+    "Sensors and their fields:\n" + legend() + "\n"
+    "Units: time.utc and location.last_update are UNIX timestamps; location is in degrees,\n"
+    "metres, m/s and degrees of bearing; battery charge is percent and temperature is Celsius.\n"
+    "rns_transport summarizes the sender's Reticulum node: transport (whether it is a\n"
+    "Transport Node), uptime in seconds, rx/tx_speed in bits/s, rx/tx_bytes received and sent\n"
+    "since the previous reading, and per interface its status, bitrate, RSSI (dBm), SNR (dB)\n"
+    "and traffic. Reticulum distinguishes between two types of network nodes: all nodes are\n"
+    "Reticulum Instances, and some are also Transport Nodes.\n"
+)
+
+HEADER = (
+    "You are the Echo/AI Assistant on the Reticulum mesh.\n"
+    "Analyze trends in the sensor telemetry below. The newest reading is given in full;\n"
+    "each earlier reading lists only the fields that differ from the reading after it.\n"
+    "Long-term trends, when present, summarize far more readings than are listed.\n"
+    "Nearby nodes, when present, are other senders by distance from this sender's position.\n"
+    "Always be concise, helpful, acknowledge the source of information if it comes from\n"
+    "sensor data, and mention if a trend was observed.\n\n"
+)
+
+SYSTEM_PROMPT = HEADER + LEGEND
+
+NO_TELEMETRY = "You are the Echo/AI Assistant. No telemetry available.\n"
+
+def _clean(value, ndigits):
+    if isinstance(value, float):
+        return round(value, ndigits)
+    if isinstance(value, bytes):
+        return safe_json(value)
+    if isinstance(value, dict):
+        return {k: _clean(v, ndigits) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(v, ndigits) for v in value]
+    return value
+
+def _network(stats):
+    # Readings stored before summarization (or with NETSTATS_RAW = "keep") still
+    # carry the raw blob; those are summarized here, without traffic deltas
+    return netstats.summarize(stats) if netstats.is_raw(stats) else stats
+
+def normalize(data):
+    """Telemetry by sensor name, ignored sensors dropped and floats rounded."""
+    named = to_named(data)
+    if "rns_transport" in named:
+        named["rns_transport"] = _network(named["rns_transport"])
+    return {name: _clean(value, PRECISION.get(name, DEFAULT_PRECISION)) for name, value in named.items()}
+
+def _flatten(value, path, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(v, f"{path}.{k}", out)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            _flatten(v, f"{path}.{i}", out)
+    else:
+        out[path] = value
+    return out
+
+def flatten(data):
+    out = {}
+    for k, v in data.items():
+        _flatten(v, str(k), out)
+    return out
+
+def _dump(value):
+    return json.dumps(value, separators=(",", ":"), default=safe_json)
+
+def _stamp(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+def render_full(entry, label):
+    return f"--- {label} ({_stamp(entry['updated_at'])}) ---\n{_dump(normalize(entry['data']))}\n"
+
+def render_delta(entry, reference, label):
+    """Lists the fields of entry whose value differs from reference."""
+    ours, theirs = flatten(normalize(entry["data"])), flatten(normalize(reference["data"]))
+    changed = {path: value for path, value in ours.items() if path not in theirs or theirs[path] != value}
+    body = _dump(changed) if changed else "(no change)"
+    return f"--- {label} ({_stamp(entry['updated_at'])}) ---\n{body}\n"
+
+def _number(value, metric):
+    value = round(value, PRECISION.get(metric.split(".")[0], DEFAULT_PRECISION))
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+def render_trends(trends, budget=TREND_BUDGET_CHARS):
+    """One line per metric with min/avg/max per window, cut off at budget characters.
+
+    A window that holds no more readings than the shorter one before it is
+    left out, since it would repeat the same numbers.
+    """
+    if not trends:
+        return ""
+    heading = "--- LONG-TERM TRENDS (min/avg/max, readings) ---\n"
+    lines, used = [], len(heading)
+    for metric in sorted(trends):
+        parts, previous = [], None
+        for label, (count, low, mean, high) in trends[metric].items():
+            if count == previous:
+                continue
+            previous = count
+            parts.append(f"{label} {_number(low, metric)}/{_number(mean, metric)}/{_number(high, metric)} ({count})")
+        line = f"{metric}: {', '.join(parts)}\n"
+        if used + len(line) > budget:
+            break
+        lines.append(line)
+        used += len(line)
+    return heading + "".join(lines) if lines else ""
+
+def _distance(metres):
+    return f"{metres / 1000:.1f} km" if metres >= 1000 else f"{metres:.0f} m"
+
+def render_nearby(nearby, budget=NEARBY_BUDGET_CHARS):
+    """One line per nearby sender with distance, altitude and time of fix."""
+    if not nearby:
+        return ""
+    heading = "--- NEARBY NODES (distance, altitude, last position) ---\n"
+    lines, used = [], len(heading)
+    for node in nearby:
+        altitude = node["altitude"]
+        altitude = f"{altitude:.0f} m" if isinstance(altitude, (int, float)) else "?"
+        line = f"{node['source'][:8]}: {_distance(node['distance'])}, {altitude}, {_stamp(node['updated_at'])}\n"
+        if used + len(line) > budget:
+            break
+        lines.append(line)
+        used += len(line)
+    return heading + "".join(lines) if lines else ""
+
+def _report(prompt, shown, total):
+    metrics.observe("prompt.chars", len(prompt), metrics.SIZE_BUCKETS)
+    logger.info("Prompt built", extra=kv("prompt", chars=len(prompt), tokens=len(prompt) // 4, readings=f"{shown}/{total}"))
+    return prompt
+
+def build_prompt(history, budget=PROMPT_BUDGET_CHARS, preamble=True, trends=None, nearby=None):
+    """Renders history (newest first) into a prompt no longer than budget characters.
+
+    Earlier readings are dropped oldest-first once the budget is reached;
+    the trends and nearby sections have their own fixed budgets and are rendered first.
+    Without the preamble only the readings are rendered, for sessions whose
+    model already carries SYSTEM_PROMPT as its system instruction.
+    """
+    if not history:
+        return NO_TELEMETRY if preamble else "No telemetry available.\n"
+
+    summary = render_trends(trends) + render_nearby(nearby)
+    fixed = (len(HEADER) + len(LEGEND) + 1 if preamble else 0) + len(summary)
+    sections = [render_full(history[0], "NEWEST")]
+    used = fixed + len(sections[0])
+    if used > budget:
+        keep = max(budget - fixed - 4, 0)
+        sections[0] = sections[0][:keep] + "...\n"
+    for i in range(1, len(history)):
+        section = render_delta(history[i], history[i - 1], f"PREVIOUS {i}")
+        if used + len(section) > budget:
+            break
+        sections.append(section)
+        used += len(section)
+
+    body = summary + "".join(sections)
+    prompt = HEADER + body + "\n" + LEGEND if preamble else body
+    return _report(prompt, len(sections), len(history))
+
+def build_update(history, since, budget=PROMPT_BUDGET_CHARS):
+    """Renders only readings newer than `since`, each as a delta to the one before it.
+
+    Like build_prompt, readings are dropped oldest-first once the budget is reached.
+    """
+    new = [entry for entry in history if entry["updated_at"] > since]
+    if not new:
+        return ""
+
+    sections, used = [], 0
+    for i in range(len(new)):
+        if i + 1 < len(history):
+            section = render_delta(history[i], history[i + 1], "NEW READING")
+        else:
+            section = render_full(history[i], "NEW READING")
+        if used + len(section) > budget and sections:
+            break
+        sections.append(section)
+        used += len(section)
+    # Oldest first, so the model reads the updates in the order they happened
+    sections.reverse()
+    return _report("".join(sections), len(sections), len(new))
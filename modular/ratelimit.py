@@ -0,0 +1,82 @@
+import threading, time
+from collections import OrderedDict
+from functools import partial
+from .utils import logger
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.warned = False  # a rejection notice was sent since the last allowed request
+
+
+class RateLimiter:
+    """Token bucket per key; buckets for the least recently seen keys are
+    dropped beyond max_keys, which only ever makes a limit more lenient."""
+
+    def __init__(self, per_minute, burst, max_keys):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Returns (allowed, first_rejection)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                bucket.warned = False
+                return True, False
+            self.rejected += 1
+            first = not bucket.warned
+            bucket.warned = True
+            return False, first
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class Admission:
+    """Applies per-sender chat and ingest limits to a dispatcher job.
+
+    A sender over its chat budget has the question dropped (with one short
+    notice per burst when `notify` is set) while its telemetry is still
+    ingested within the separate ingest budget. The notice is attached to
+    the job for a worker to send, as admission runs on the delivery callback.
+    """
+
+    def __init__(self, chat, ingest, notify=None):
+        self.chat = chat
+        self.ingest = ingest
+        self.notify = notify
+
+    def __call__(self, job):
+        if job.reply:
+            allowed, first = self.chat.check(job.source)
+            if not allowed:
+                job.reply = False
+                logger.info("Chat rate limit hit for %s", job.source.hex()[:5])
+                if first and self.notify:
+                    job.notice = partial(self.notify, job.source.hex())
+        if job.ingest and not self.ingest.check(job.source)[0]:
+            job.ingest = False
+        return bool(job.reply or job.ingest or job.notice)
+
+    def stats(self):
+        return {"chat_rejected": self.chat.rejected, "ingest_rejected": self.ingest.rejected,
+                "tracked_senders": len(self.chat)}
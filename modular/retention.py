@@ -0,0 +1,48 @@
+import time
+from . import db
+from .scheduler import RunAgain
+from .utils import logger
+
+
+class Retention:
+    """Deletes expired telemetry a small batch at a time.
+
+    Each step removes at most one batch of rows older than max_age and
+    trims a few senders down to max_rows (rollup buckets expire per
+    resolution the same way), so the sweep never holds the
+    write lock for long and can run alongside live ingest.
+    """
+
+    def __init__(self, max_age, max_rows, batch, rollup_keep=None, senders_per_step=8):
+        self.max_age = max_age
+        self.rollup_keep = rollup_keep or {}
+        self.max_rows = max_rows
+        self.batch = batch
+        self.senders_per_step = senders_per_step
+        self.deleted = 0
+        self._cursor = ""
+
+    def step(self):
+        deleted = 0
+        if self.max_age:
+            deleted += db.delete_expired(time.time() - self.max_age, self.batch)
+        if self.max_rows:
+            for _ in range(self.senders_per_step):
+                source = db.next_source(self._cursor)
+                if source is None:
+                    self._cursor = ""
+                    break
+                self._cursor = source
+                deleted += db.trim_source(source, self.max_rows, self.batch)
+        for resolution, keep in self.rollup_keep.items():
+            deleted += db.delete_rollups(resolution, time.time() - keep, self.batch)
+        self.deleted += deleted
+        return deleted
+
+    def sweep(self):
+        """One step as a scheduler job: asks to run again in a second while
+        there is a backlog, otherwise waits for the regular interval."""
+        deleted = self.step()
+        if deleted:
+            logger.info("Retention removed %s telemetry and rollup rows", deleted)
+        return RunAgain(1) if deleted >= self.batch else None
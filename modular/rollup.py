@@ -0,0 +1,69 @@
+import math
+from .telemetry import to_named
+
+# Bucket sizes in seconds; buckets are aligned to UTC
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (HOUR, DAY)
+
+# Sensors and fields that are not worth aggregating: clocks, identifiers and
+# the transport stats blob
+SKIP_SENSORS = {"time", "information", "rns_transport"}
+SKIP_FIELDS = {"last_update"}
+
+# SQLite integers are signed 64-bit
+INT64_MAX = 2 ** 63 - 1
+
+UPSERT_ROLLUP = """
+    INSERT INTO rollups (source_hash_hex, resolution, bucket, metric, count, min, max, sum, last, last_at)
+    VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+    ON CONFLICT (source_hash_hex, resolution, bucket, metric) DO UPDATE SET
+        count = count + 1,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max),
+        sum = sum + excluded.sum,
+        last = CASE WHEN excluded.last_at >= last_at THEN excluded.last ELSE last END,
+        last_at = MAX(last_at, excluded.last_at)
+"""
+
+
+def _number(value):
+    """value as something SQLite can store and compare, or None if it isn't a finite number.
+
+    Many sensors have no range checks, so integers beyond int64 become floats
+    rather than failing the insert, and NaN and infinities are skipped.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, int):
+        return value if abs(value) <= INT64_MAX else float(value)
+    return value if math.isfinite(value) else None
+
+def extract(data):
+    """{"sensor.field": number} for the numeric readings worth rolling up."""
+    metrics = {}
+    for name, value in to_named(data).items():
+        if name in SKIP_SENSORS:
+            continue
+        if isinstance(value, dict):
+            for field, v in value.items():
+                v = _number(v) if field not in SKIP_FIELDS else None
+                if v is not None:
+                    metrics[f"{name}.{field}"] = v
+        else:
+            value = _number(value)
+            if value is not None:
+                metrics[name] = value
+    return metrics
+
+def rows(source_hash, updated_at, data):
+    """Parameters for UPSERT_ROLLUP, one per metric and resolution."""
+    out = []
+    for metric, value in extract(data).items():
+        for resolution in RESOLUTIONS:
+            bucket = updated_at - updated_at % resolution
+            out.append((source_hash, resolution, bucket, metric, value, value, value, value, updated_at))
+    return out
+
+def resolution_for(window):
+    return HOUR if window <= 2 * DAY else DAY
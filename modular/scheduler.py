@@ -0,0 +1,157 @@
+import heapq, json, os, random, signal, threading, time
+from .utils import logger
+
+
+class Job:
+    __slots__ = ("name", "fn", "interval", "jitter", "persist")
+
+    def __init__(self, name, fn, interval, jitter, persist):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.persist = persist
+
+
+class RunAgain:
+    """Returned by a job to run again after `after` seconds instead of its interval."""
+    __slots__ = ("after",)
+
+    def __init__(self, after):
+        self.after = after
+
+
+class Scheduler:
+    """Runs periodic jobs from a single thread that sleeps until the next one is due.
+
+    Jobs are kept in a heap ordered by their next run time. Next-run times of
+    persistent jobs are written to state_path after they run and read back
+    once at startup, so a restart doesn't redo work that isn't due yet.
+    A job may return RunAgain to run again sooner (or later) than its
+    interval, e.g. while working through a backlog; any other return value
+    is ignored.
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self.runs = 0
+        self.failures = 0
+        self._jobs = {}
+        self._heap = []
+        self._seq = 0
+        self._saved = self._read()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._stopping = False
+        self._thread = None
+
+    def _read(self):
+        if not self.state_path or not os.path.isfile(self.state_path):
+            return {}
+        try:
+            with open(self.state_path) as f:
+                text = f.read()
+            try:
+                return {name: float(due) for name, due in json.loads(text).items()}
+            except (ValueError, AttributeError):
+                # Older nodes kept only the next announce time, as a bare integer
+                return {"announce": float(text.split()[0])}
+        except (OSError, ValueError, IndexError) as e:
+            logger.warning("Could not read schedule state: %s", e)
+            return {}
+
+    def _write(self):
+        with self._lock:
+            due = {entry[2]: entry[0] for entry in self._heap if self._jobs[entry[2]].persist}
+        tmp = f"{self.state_path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(due, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            logger.error("Could not write schedule state: %s", e)
+
+    def _push(self, due, name):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, name))
+
+    def every(self, name, interval, fn, jitter=0, persist=False, delay=0):
+        """Runs fn every interval seconds, shifted by up to ±jitter seconds.
+
+        The first run happens after delay seconds, or at the persisted time
+        when the job is persistent and one was saved.
+        """
+        due = self._saved.get(name) if persist else None
+        with self._lock:
+            self._jobs[name] = Job(name, fn, interval, jitter, persist)
+            self._push(due if due is not None else time.time() + delay, name)
+        self._wakeup.set()
+
+    def _next_due(self, job, now):
+        return now + job.interval + random.uniform(-job.jitter, job.jitter)
+
+    def run_pending(self):
+        """Runs every job that is due; returns seconds until the next one."""
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return None
+                due, _, name = self._heap[0]
+                now = time.time()
+                if due > now:
+                    return due - now
+                heapq.heappop(self._heap)
+                job = self._jobs[name]
+            after = None
+            try:
+                after = job.fn()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                logger.error("Scheduled job %s failed: %s", name, e)
+            now = time.time()
+            with self._lock:
+                self._push(now + after.after if isinstance(after, RunAgain) else self._next_due(job, now), name)
+            if job.persist and self.state_path:
+                self._write()
+
+    def run(self):
+        """Runs jobs until stop() is called."""
+        self._running = True
+        while self._running:
+            timeout = self.run_pending()
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def stop_on_signals(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        """Makes run() return when one of signals arrives; call from the main thread.
+
+        RNS and LXMF install handlers that end the process on the spot, so
+        these replace them to let the caller shut down cleanly first. A second
+        signal while shutting down exits immediately.
+        """
+        def handler(signum, frame):
+            if self._stopping:
+                logger.warning("Received %s again, exiting immediately", signal.Signals(signum).name)
+                os._exit(1)
+            logger.info("Received %s, shutting down...", signal.Signals(signum).name)
+            self._stopping = True
+            self.stop()
+        for signum in signals:
+            signal.signal(signum, handler)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="echo-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {"jobs": len(self._jobs), "runs": self.runs, "failures": self.failures,
+                    "next_due": self._heap[0][0] if self._heap else None}
@@ -0,0 +1,89 @@
+import re
+import RNS, LXMF
+from .config import (REPLY_TITLE, REPLY_MAX_CHARS, REPLY_SLOW_MAX_CHARS, REPLY_BUDGETS,
+                     SLOW_LINK_BITRATE, REPLY_CHUNKING, REPLY_MAX_PARTS)
+from . import metrics
+
+# Content that fits one encrypted packet goes out opportunistically, with no
+# link setup; "(9/9) " is reserved on every part when a reply is chunked.
+PACKET_CONTENT = LXMF.LXMessage.ENCRYPTED_PACKET_MAX_CONTENT - len(REPLY_TITLE.encode("utf-8"))
+PART_PREFIX = 6
+
+_MARKUP = re.compile(r"\*\*|__|`|^#+\s*", re.MULTILINE)
+_BULLET = re.compile(r"^\s*[*•]\s+", re.MULTILINE)
+_SPACES = re.compile(r"[ \t]+")
+_BLANKS = re.compile(r"\n\s*\n+")
+_SENTENCE_END = re.compile(r"[.!?](\s|$)")
+
+
+def link_profile(destination_hash):
+    """(has_path, bitrate in bits/s or None) of the next hop towards destination."""
+    if not RNS.Transport.has_path(destination_hash):
+        return False, None
+    return True, RNS.Transport.next_hop_interface_bitrate(destination_hash)
+
+def is_slow(bitrate):
+    return bitrate is not None and bitrate < SLOW_LINK_BITRATE
+
+def budget_for(destination_hex, bitrate):
+    if destination_hex in REPLY_BUDGETS:
+        return REPLY_BUDGETS[destination_hex]
+    return REPLY_SLOW_MAX_CHARS if is_slow(bitrate) else REPLY_MAX_CHARS
+
+def compact(text, budget):
+    """Strips markdown and surplus whitespace, then cuts at the last sentence within budget."""
+    text = _BULLET.sub("- ", text)
+    text = _MARKUP.sub("", text)
+    text = _SPACES.sub(" ", text)
+    text = _BLANKS.sub("\n", text).strip()
+    if len(text) <= budget:
+        return text
+    metrics.count("replies.truncated")
+    cut = text[:budget - 1]
+    ends = [m.end() for m in _SENTENCE_END.finditer(cut)]
+    if ends and ends[-1] > budget // 2:
+        return cut[:ends[-1]].rstrip()
+    return cut.rsplit(" ", 1)[0].rstrip() + "…"
+
+def chunk(text, limit):
+    """Splits text on word boundaries into parts of at most limit UTF-8 bytes."""
+    parts, current = [], ""
+    for word in text.split(" "):
+        candidate = f"{current} {word}" if current else word
+        if len(candidate.encode("utf-8")) <= limit:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+        while len(word.encode("utf-8")) > limit:
+            parts.append(word[:limit // 4])
+            word = word[limit // 4:]
+        current = word
+    if current:
+        parts.append(current)
+    return parts
+
+def plan(destination_hash, text, message_router):
+    """Shapes a reply for the link towards destination.
+
+    Returns [(content, desired_method)]: one opportunistic packet when the
+    reply fits, numbered opportunistic parts on slow links, a propagated
+    message when there is no path but a propagation node is set, and a
+    direct message otherwise.
+    """
+    has_path, bitrate = link_profile(destination_hash)
+    text = compact(text, budget_for(destination_hash.hex(), bitrate))
+    size = len(text.encode("utf-8"))
+    metrics.observe("reply.bytes", size, metrics.SIZE_BUCKETS)
+
+    if size <= PACKET_CONTENT:
+        return [(text, LXMF.LXMessage.OPPORTUNISTIC)]
+    if not has_path and message_router.get_outbound_propagation_node() is not None:
+        return [(text, LXMF.LXMessage.PROPAGATED)]
+    if REPLY_CHUNKING and is_slow(bitrate):
+        parts = chunk(text, PACKET_CONTENT - PART_PREFIX)
+        if len(parts) <= REPLY_MAX_PARTS:
+            metrics.count("replies.chunked")
+            return [(f"({i}/{len(parts)}) {part}", LXMF.LXMessage.OPPORTUNISTIC)
+                    for i, part in enumerate(parts, 1)]
+    return [(text, LXMF.LXMessage.DIRECT)]
@@ -1,19 +1,216 @@
 import struct
 from .utils import logger
 
+# Sideband packs location as scaled integers: lat/lon * 1e6, altitude,
+# speed and bearing * 1e2 as 32-bit values and accuracy * 1e2 as 16 bits,
+# followed by the last-update timestamp. One precompiled Struct unpacks
+# the six packed fields in a single call.
+_LOCATION = struct.Struct("!iiiIiH")
+_LOCATION_SIZES = (4, 4, 4, 4, 4, 2)
+_LOCATION_SCALE = (1e6, 1e6, 1e2, 1e2, 1e2, 1e2)
+_I32 = struct.Struct("!i")
+
+
+class Sensor:
+    """Base for typed sensor records.
+
+    `plain()` is the storage form (a positional list, or a scalar for
+    single-value sensors) and `named()` the field-name form used for
+    prompts; `from_plain()` rebuilds a record from stored data.
+    """
+
+    __slots__ = ()
+    sid = None
+    name = None
+    fields = ()
+    ranges = {}
+
+    def __init__(self, *values):
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+        for field in self.fields[len(values):]:
+            setattr(self, field, None)
+
+    @classmethod
+    def unpack(cls, value):
+        return cls.from_plain(value)
+
+    @classmethod
+    def from_plain(cls, value):
+        if len(cls.fields) == 1:
+            return cls(value)
+        return cls(*value[:len(cls.fields)])
+
+    def validate(self):
+        for field, (low, high) in self.ranges.items():
+            value = getattr(self, field)
+            if isinstance(value, (int, float)) and not low <= value <= high:
+                logger.warning("%s.%s out of range: %s", self.name, field, value)
+                setattr(self, field, None)
+        return self
+
+    def plain(self):
+        if len(self.fields) == 1:
+            return getattr(self, self.fields[0])
+        return [getattr(self, field) for field in self.fields]
+
+    def named(self):
+        if len(self.fields) == 1:
+            return getattr(self, self.fields[0])
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.plain()!r})"
+
+
+class Time(Sensor):
+    __slots__ = ("utc",)
+    sid, name, fields = 1, "time", ("utc",)
+
+
+class Location(Sensor):
+    __slots__ = ("latitude", "longitude", "altitude", "speed", "bearing", "accuracy", "last_update")
+    sid, name = 2, "location"
+    fields = __slots__
+    ranges = {"latitude": (-90, 90), "longitude": (-180, 180), "bearing": (-360, 360)}
+
+    @classmethod
+    def unpack(cls, value):
+        if not isinstance(value, list):
+            return cls.from_plain(value)
+        packed = value[:6]
+        if len(packed) == 6 and all(isinstance(p, bytes) and len(p) == n for p, n in zip(packed, _LOCATION_SIZES)):
+            numbers = [v / scale for v, scale in zip(_LOCATION.unpack(b"".join(packed)), _LOCATION_SCALE)]
+            return cls(*numbers, *value[6:7])
+        # Older or partial packings: decode each 4-byte coordinate on its own
+        return cls(*[_I32.unpack(v)[0] / 1e6 if isinstance(v, bytes) and len(v) == 4 else v for v in value])
+
+
+class Battery(Sensor):
+    __slots__ = ("charge_percent", "charging", "temperature")
+    sid, name, fields = 4, "battery", __slots__
+    ranges = {"charge_percent": (0, 100)}
+
+
+class Acceleration(Sensor):
+    __slots__ = ("x", "y", "z")
+    sid, name, fields = 6, "acceleration", __slots__
+
+
+class MagneticField(Sensor):
+    __slots__ = ("x", "y", "z")
+    sid, name, fields = 9, "magnetic_field", __slots__
+
+
+class AmbientLight(Sensor):
+    __slots__ = ("lux",)
+    sid, name, fields = 10, "ambient_light", __slots__
+    ranges = {"lux": (0, 200000)}
+
+
+class Gravity(Sensor):
+    __slots__ = ("x", "y", "z")
+    sid, name, fields = 11, "gravity", __slots__
+
+
+class AngularVelocity(Sensor):
+    __slots__ = ("x", "y", "z")
+    sid, name, fields = 12, "angular_velocity", __slots__
+
+
+class Proximity(Sensor):
+    __slots__ = ("triggered",)
+    sid, name, fields = 14, "proximity", __slots__
+
+
+class Information(Sensor):
+    __slots__ = ("contents",)
+    sid, name, fields = 15, "information", __slots__
+
+
+class RNSTransport(Sensor):
+    """Network transport stats and interfaces, kept as the structured dict Sideband sends."""
+
+    __slots__ = ("stats",)
+    sid, name, fields = 25, "rns_transport", __slots__
+
+
+SCHEMA = {cls.sid: cls for cls in (
+    Time, Location, Battery, Acceleration, MagneticField, AmbientLight,
+    Gravity, AngularVelocity, Proximity, Information, RNSTransport,
+)}
+
+# Sideband sensors this node ignores (pressure, temperature, humidity)
+IGNORED = {3, 7, 8}
+
+def _sid(key):
+    return int(key) if isinstance(key, str) and key.isdigit() else key
+
 def decode(data):
+    """Decodes an unpacked Sideband telemetry dict into {sid: Sensor} in one pass.
+
+    Unknown sensors are kept as their raw values; a sensor that fails to
+    decode is kept raw too, so one bad field never loses the others.
+    """
     if not isinstance(data, dict):
         return data
-    if 2 in data and isinstance(data[2], list):
-        decoded = []
-        for item in data[2]:
-            if isinstance(item, bytes) and len(item) == 4:
-                try:
-                    decoded.append(struct.unpack(">i", item)[0] / 1_000_000)
-                except struct.error:
-                    logger.warning(f"Bad 4-byte location: {item!r}")
-                    decoded.append(item)
-            else:
-                decoded.append(item)
-        data[2] = decoded
-    return data
+    decoded = {}
+    for key, value in data.items():
+        sid = _sid(key)
+        cls = SCHEMA.get(sid)
+        if cls is None:
+            decoded[sid] = value
+            continue
+        try:
+            decoded[sid] = cls.unpack(value).validate()
+        except (struct.error, TypeError, ValueError) as e:
+            logger.warning("Could not decode sensor %s: %s", sid, e)
+            decoded[sid] = value
+    return decoded
+
+def to_plain(decoded):
+    """Storage form of decoded telemetry: {sid: list or scalar}."""
+    if not isinstance(decoded, dict):
+        return decoded
+    return {sid: value.plain() if isinstance(value, Sensor) else value for sid, value in decoded.items()}
+
+def from_plain(data):
+    """Rebuilds records from stored telemetry; unknown sensors stay as they are."""
+    if not isinstance(data, dict):
+        return {}
+    records = {}
+    for key, value in data.items():
+        sid = _sid(key)
+        cls = SCHEMA.get(sid)
+        try:
+            records[sid] = cls.from_plain(value) if cls is not None else value
+        except (TypeError, ValueError):
+            records[sid] = value
+    return records
+
+def to_named(data):
+    """{sensor name: named fields} for prompts, from stored or decoded telemetry."""
+    named = {}
+    for sid, value in (data.items() if isinstance(data, dict) else ()):
+        if isinstance(value, Sensor):
+            named[value.name] = value.named()
+            continue
+        sid = _sid(sid)
+        if sid in IGNORED:
+            continue
+        cls = SCHEMA.get(sid)
+        if cls is None:
+            named[f"sensor_{sid}"] = value
+            continue
+        try:
+            named[cls.name] = cls.from_plain(value).named()
+        except (TypeError, ValueError):
+            named[cls.name] = value
+    return named
+
+def legend():
+    lines = []
+    for sid, cls in SCHEMA.items():
+        fields = ", ".join(cls.fields) if len(cls.fields) > 1 else cls.fields[0]
+        lines.append(f"{cls.name}: {fields}")
+    return "\n".join(lines)
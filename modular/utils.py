@@ -1,12 +1,75 @@
-import logging
-import RNS
+import atexit, itertools, logging, queue, time
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(
-    level=RNS.LOG_VERBOSE,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
 logger = logging.getLogger("echo-ai")
 
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+def kv(category=None, **fields):
+    """`extra` for a structured record: a sampling category plus key=value fields."""
+    return {"category": category, "kv": fields}
+
+
+class lazy:
+    """Log argument computed only if the record is actually formatted."""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+
+class KeyValueFormatter(logging.Formatter):
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = getattr(record, "kv", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items() if v is not None)
+        return line
+
+
+class Sampler(logging.Filter):
+    """Keeps one in every `rate` records per category; warnings and errors always pass."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {category: rate for category, rate in rates.items() if rate > 1}
+        self._counters = {category: itertools.count() for category in self.rates}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "category", None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return next(self._counters[record.category]) % rate == 0
+
+
+class _QueueHandler(QueueHandler):
+    # The stock prepare() formats the message on the calling thread; passing the
+    # record through leaves %-formatting and lazy arguments to the listener.
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, sample=None):
+    """Routes all logging through a queue to a listener thread that formats and writes it."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    front = _QueueHandler(records)
+    front.addFilter(Sampler(sample or {}))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers[:] = [front]
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
 def safe_json(obj):
     if isinstance(obj, bytes):
         try:
@@ -14,3 +77,27 @@ def safe_json(obj):
         except UnicodeDecodeError:
             return obj.hex()
     raise TypeError(f"Type {type(obj)} not serializable")
+
+
+class Startup:
+    """Wall-clock time per startup phase, for the startup report."""
+
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.phases = []
+        self._mark = self.started
+
+    def done(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._mark))
+        self._mark = now
+
+    def total(self):
+        return self._mark - self.started
+
+    def summary(self):
+        return {"total": self.total(), **dict(self.phases)}
+
+    def report(self):
+        parts = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        logger.info("Startup took %.2fs (%s)", self.total(), parts)
@@ -0,0 +1,151 @@
+import sqlite3, threading, time
+from .utils import logger
+
+# Errors caused by the contents of a row rather than by the database
+ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.InterfaceError,
+              OverflowError, ValueError, TypeError)
+MAX_BACKOFF = 30  # seconds between attempts at a batch the database keeps rejecting
+
+
+class WriteBehind:
+    """Collects rows and hands them to `flush` in batches.
+
+    A batch is flushed once it holds max_rows rows or its oldest row is
+    max_staleness_ms old, so a burst of readings costs one transaction
+    instead of one commit each. Rows stay visible through pending() until
+    their batch has been committed.
+
+    When a batch fails because of a row's contents (ROW_ERRORS) its rows are
+    retried one at a time, and the ones that still fail are logged and
+    dropped so a single bad row can't hold back everyone else's. Any other
+    error is the database's: the whole batch is retried with backoff, for
+    as long as it takes when the database is locked or busy
+    (OperationalError), otherwise for up to max_retries more attempts.
+    At most max_pending rows are buffered; beyond that the oldest are dropped.
+    """
+
+    def __init__(self, flush, max_rows, max_staleness_ms, max_retries=5, max_pending=10000):
+        self._flush = flush
+        self.max_rows = max_rows
+        self.max_staleness = max_staleness_ms / 1000
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.flushed = 0
+        self.dropped = 0
+        self._failures = 0
+        self._rows = []
+        self._inflight = []
+        self._oldest = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="echo-writebehind", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=True):
+        with self._cond:
+            self._running = False
+            if not flush:
+                self._rows = []
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def add(self, row):
+        with self._cond:
+            if not self._rows:
+                self._oldest = time.monotonic()
+                # Wakes the writer so it starts waiting out max_staleness
+                self._cond.notify()
+            self._rows.append(row)
+            if len(self._rows) > self.max_pending:
+                del self._rows[0]
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.error("Write-behind buffer full, dropped %d rows so far", self.dropped)
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify()
+
+    def pending(self, match):
+        with self._cond:
+            return [row for row in self._inflight + self._rows if match(row)]
+
+    def depth(self):
+        with self._cond:
+            return len(self._rows) + len(self._inflight)
+
+    def _take(self):
+        with self._cond:
+            while True:
+                if self._rows:
+                    due = self._oldest + self.max_staleness - time.monotonic()
+                    if len(self._rows) >= self.max_rows or due <= 0 or not self._running:
+                        break
+                    self._cond.wait(due)
+                elif not self._running:
+                    return None
+                else:
+                    self._cond.wait()
+            self._inflight, self._rows = self._rows, []
+            return self._inflight
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            retry = []
+            try:
+                self._flush(batch)
+                self.flushed += len(batch)
+                self._failures = 0
+            except ROW_ERRORS as e:
+                logger.error("Write-behind flush of %d rows failed, retrying them one by one: %s", len(batch), e)
+                failed, retry = self._flush_each(batch)
+                self._drop(failed, "could not be stored")
+            except sqlite3.OperationalError as e:
+                # Locked or busy, e.g. while an import holds the write lock: wait it out
+                logger.warning("Write-behind flush of %d rows failed, will retry: %s", len(batch), e)
+                retry = batch
+            except Exception as e:
+                logger.error("Write-behind flush of %d rows failed: %s", len(batch), e)
+                if self._failures >= self.max_retries:
+                    self._failures = 0
+                    self._drop(batch, f"still failing after {self.max_retries} retries")
+                else:
+                    retry = batch
+            with self._cond:
+                self._inflight = []
+                if not retry:
+                    continue
+                # Keep the rows for the next attempt
+                self._rows = retry + self._rows
+                self._oldest = time.monotonic()
+                self._failures += 1
+                self._cond.wait_for(lambda: not self._running, min(2 ** (self._failures - 1), MAX_BACKOFF))
+                if not self._running:
+                    return
+
+    def _flush_each(self, batch):
+        """Flushes rows singly; returns the rows at fault and, if the database
+        itself failed part way, the rows not yet attempted."""
+        failed = []
+        for i, row in enumerate(batch):
+            try:
+                self._flush([row])
+                self.flushed += 1
+            except ROW_ERRORS:
+                failed.append(row)
+            except Exception as e:
+                logger.warning("Write-behind flush stopped, will retry: %s", e)
+                return failed, batch[i:]
+        return failed, []
+
+    def _drop(self, rows, reason):
+        self.dropped += len(rows)
+        for row in rows:
+            logger.error("Dropping buffered row from %s at %s: %s", str(row[0])[:5], row[1], reason)
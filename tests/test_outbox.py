@@ -0,0 +1,57 @@
+import inspect, time
+import pytest
+from modular import db
+from modular.outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    db.init_db(str(tmp_path / "modular.db"), write_behind=False)
+    sent = []
+    box = Outbox(lambda destination, content: sent.append((destination, content)) or True, 3600, 3)
+    box.start()
+    yield box, sent
+    box.stop(timeout=5)
+    db.close()
+
+
+def announce_like_transport(handler, destination_hash):
+    """Calls handler.received_announce the way RNS.Transport.inbound does."""
+    kwargs = {"destination_hash": destination_hash, "announced_identity": None, "app_data": None}
+    count = len(inspect.signature(handler.received_announce).parameters)
+    if count >= 4:
+        kwargs["announce_packet_hash"] = b"\x00" * 32
+    if count == 5:
+        kwargs["is_path_response"] = False
+    handler.received_announce(**kwargs)
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_announce_flushes_held_replies(outbox):
+    box, sent = outbox
+    destination = "ab" * 16
+    box.put(destination, "first")
+    box.put(destination, "second")
+
+    announce_like_transport(box, bytes.fromhex(destination))
+
+    assert wait_for(lambda: len(sent) == 2)
+    assert sent == [(destination, "first"), (destination, "second")]
+    assert box.stats()["depth"] == 0
+
+
+def test_announce_for_other_destination_is_ignored(outbox):
+    box, sent = outbox
+    box.put("ab" * 16, "held")
+
+    announce_like_transport(box, bytes.fromhex("cd" * 16))
+
+    time.sleep(0.1)
+    assert sent == []
+    assert box.stats()["depth"] == 1
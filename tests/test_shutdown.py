@@ -0,0 +1,45 @@
+import os, signal, sqlite3
+import pytest
+from modular import db
+from modular.scheduler import Scheduler
+
+
+@pytest.fixture(autouse=True)
+def restore_handlers():
+    saved = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+    yield
+    for s, handler in saved.items():
+        signal.signal(s, handler)
+
+
+@pytest.mark.parametrize("signum", [signal.SIGINT, signal.SIGTERM])
+def test_signal_during_run_returns(signum):
+    scheduler = Scheduler()
+    ran = []
+    scheduler.every("tick", 3600, lambda: ran.append(1))
+    scheduler.every("signal", 3600, lambda: os.kill(os.getpid(), signum), delay=0.05)
+    # Like RNS and LXMF, something else installed a handler first
+    signal.signal(signum, lambda *args: pytest.fail("previous handler ran"))
+    scheduler.stop_on_signals()
+
+    scheduler.run()
+
+    assert ran == [1]
+
+
+def test_buffered_telemetry_is_written_on_sigterm(tmp_path):
+    path = str(tmp_path / "modular.db")
+    db.init_db(path)
+    db._buffer.max_staleness = 3600  # keep the reading buffered until shutdown
+    db.save("ab" * 16, {4: [80, 1, 0]})
+    scheduler = Scheduler()
+    scheduler.every("signal", 3600, lambda: os.kill(os.getpid(), signal.SIGTERM), delay=0.05)
+    scheduler.stop_on_signals()
+
+    scheduler.run()
+    db.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM telemetry").fetchone()[0] == 1
+    conn.close()
+    assert not os.path.exists(path + "-wal")
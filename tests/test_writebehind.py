@@ -0,0 +1,46 @@
+import sqlite3, time
+from modular.writebehind import WriteBehind
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_bad_row_is_dropped_and_the_rest_committed():
+    stored = []
+
+    def flush(rows):
+        if any(row[1] > 2 ** 63 - 1 for row in rows):
+            raise OverflowError("Python int too large to convert to SQLite INTEGER")
+        stored.extend(rows)
+
+    buffer = WriteBehind(flush, 10, 10)
+    buffer.start()
+    buffer.add(("bad", 2 ** 63))
+    buffer.add(("good", 1))
+    assert wait_for(lambda: buffer.depth() == 0)
+    buffer.stop()
+    assert stored == [("good", 1)]
+    assert buffer.dropped == 1
+
+
+def test_locked_database_retries_the_whole_batch():
+    calls = []
+
+    def flush(rows):
+        calls.append(len(rows))
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+
+    buffer = WriteBehind(flush, 10, 10, max_retries=1)
+    buffer.start()
+    for i in range(5):
+        buffer.add(("source", i))
+    assert wait_for(lambda: buffer.flushed == 5)
+    buffer.stop()
+    # Never row by row, and not dropped despite exceeding max_retries
+    assert calls == [5, 5, 5]
+    assert buffer.dropped == 0